@@ -0,0 +1,257 @@
+import json
+import os
+import re
+
+from blob_store import put_blob, get_blob, resolve_message, externalize_message
+from messages import Message, init_chat_tree
+
+READ_CHUNK = 1024 * 1024
+ARCHIVE_VERSION = 1
+
+# Blob references in attachment records and the keys their content is archived under
+ATTACHMENT_BLOBS = (("id", "content"), ("thumbnail", "thumbnail_content"))
+
+_decoder = json.JSONDecoder()
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def _stream_to_file(path, lines, total, progress):
+    """Writes lines to path.tmp and renames it into place once complete."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for done, chunk in lines:
+            f.write(chunk)
+            if progress:
+                progress(done, total)
+    os.replace(tmp_path, path)
+
+
+def _export_attachment(att):
+    out = dict(att)
+    for field, key in ATTACHMENT_BLOBS:
+        if att.get(field):
+            out[key] = get_blob(att[field])
+    return out
+
+
+def _import_attachment(att):
+    """Stores archived attachment content in the blob store; None if nothing usable is left."""
+    clean = {k: v for k, v in att.items() if k not in dict(ATTACHMENT_BLOBS).values()}
+    for field, key in ATTACHMENT_BLOBS:
+        if isinstance(att.get(key), str):
+            clean[field] = put_blob(att[key])
+    return clean if clean.get("id") and clean.get("name") else None
+
+
+def export_jsonl(histories, path, progress=None):
+    """
+    Streams chats to a JSONL archive: one "chat" header line per chat followed
+    by one "message" line per message. Chats with branches are written whole:
+    the header carries the active "leaf" and every message of the tree its
+    "parent". Blob references are resolved so the archive is self-contained.
+    progress(done, total) is called per chat.
+    """
+    def lines():
+        yield 0, json.dumps({"type": "archive", "version": ARCHIVE_VERSION}) + "\n"
+        for i, hist in enumerate(histories):
+            header = {"type": "chat", "title": hist.get("title", "")}
+            if "tree" in hist:
+                header["leaf"] = hist.get("leaf")
+            yield i, json.dumps(header, ensure_ascii=False) + "\n"
+            for msg in hist["tree"] if "tree" in hist else hist.get("history", []):
+                out = dict(resolve_message(msg), type="message")
+                if out.get("attachments"):
+                    out["attachments"] = [_export_attachment(att) for att in out["attachments"]]
+                yield i, json.dumps(out, ensure_ascii=False, default=str) + "\n"
+        yield len(histories), ""
+    _stream_to_file(path, lines(), len(histories), progress)
+
+
+def export_markdown(histories, path, progress=None):
+    """Streams chats to a single Markdown document, one section per chat with its active branch."""
+    def lines():
+        for i, hist in enumerate(histories):
+            yield i, f"# {hist.get('title', 'Chat')}\n\n"
+            for msg in hist.get("history", []):
+                msg = resolve_message(msg)
+                role = msg.get("role", "assistant").capitalize()
+                yield i, f"**{role}:**\n\n{msg.get('content', '')}\n\n"
+                if msg.get("think_content"):
+                    quoted = "\n".join("> " + line for line in msg["think_content"].splitlines())
+                    yield i, f"<details><summary>Thinking</summary>\n\n{quoted}\n\n</details>\n\n"
+            yield i, "---\n\n"
+        yield len(histories), ""
+    _stream_to_file(path, lines(), len(histories), progress)
+
+
+def _iter_values(f, head):
+    """
+    Incrementally decodes top-level JSON values: the elements of an array, or
+    a sequence of concatenated/newline-delimited objects (JSONL). Memory is
+    bounded by the largest single value.
+    """
+    in_array = head == "["
+    buf = "" if in_array else head
+    pos = 0
+    eof = False
+    while True:
+        pos = _SEPARATORS.match(buf, pos).end()
+        if in_array and buf.startswith("]", pos):
+            return
+        if pos < len(buf):
+            try:
+                obj, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield obj
+                pos = end
+                continue
+        if eof:
+            return
+        buf = buf[pos:]
+        pos = 0
+        # Read at least as much as is buffered so a huge value is re-scanned O(log n) times
+        chunk = f.read(max(READ_CHUNK, len(buf)))
+        if not chunk:
+            eof = True
+        buf += chunk
+
+
+def _chatgpt_messages(mapping):
+    """Flattens a ChatGPT export "mapping" tree into a list along the main branch."""
+    nodes = mapping or {}
+    root = next((k for k, n in nodes.items() if not n.get("parent")), None)
+    messages = []
+    node_id = root
+    while node_id:
+        node = nodes.get(node_id, {})
+        msg = node.get("message") or {}
+        role = (msg.get("author") or {}).get("role")
+        parts = (msg.get("content") or {}).get("parts") or []
+        text = "\n".join(p for p in parts if isinstance(p, str)).strip()
+        if role in ("user", "assistant") and text:
+            messages.append({"role": role, "content": text})
+        children = node.get("children") or []
+        node_id = children[-1] if children else None  # Last child is the latest edit
+    return messages
+
+
+def _clean_message(msg):
+    """A Message with only the fields this client uses, or None if msg is not a chat turn."""
+    if not isinstance(msg, dict) or "content" not in msg:
+        return None
+    # Saved chats keep long fields as blob references; load them like export_jsonl does
+    msg = resolve_message(msg)
+    role = msg.get("role", "assistant")
+    if role not in ("user", "assistant"):
+        return None
+    clean = {"role": role, "content": str(msg["content"])}
+    if msg.get("think_content"):
+        clean["think_content"] = msg["think_content"]
+    if isinstance(msg.get("tool_results"), list):
+        clean["tool_results"] = [
+            {"name": r.get("name"), "content_blob": put_blob(str(r.get("content") or ""))}
+            for r in msg["tool_results"] if isinstance(r, dict)
+        ]
+    if isinstance(msg.get("attachments"), list):
+        attachments = [_import_attachment(a) for a in msg["attachments"] if isinstance(a, dict)]
+        if any(attachments):
+            clean["attachments"] = [a for a in attachments if a]
+    return externalize_message(Message.from_dict(clean))
+
+
+def _clean_tree(raw, leaf):
+    """
+    Cleans the messages of a branched chat and remaps parent and leaf indexes.
+    A dropped message's children are attached to its nearest kept ancestor.
+    """
+    tree, kept = [], {}  # kept: index in raw -> index in tree
+
+    def ancestor(i):
+        while i is not None and i not in kept:
+            parent = raw[i].get("parent") if isinstance(raw[i], dict) else None
+            i = parent if isinstance(parent, int) and 0 <= parent < i else None
+        return None if i is None else kept[i]
+
+    for i, msg in enumerate(raw):
+        clean = _clean_message(msg)
+        if clean is None:
+            continue
+        parent = msg.get("parent")
+        clean.parent = ancestor(parent) if isinstance(parent, int) and 0 <= parent < i else None
+        kept[i] = len(tree)
+        tree.append(clean)
+    leaf = ancestor(leaf) if isinstance(leaf, int) and 0 <= leaf < len(raw) else None
+    return tree, leaf
+
+
+def _normalize_chat(obj):
+    """
+    Maps a chat object from this or another client's format to a chat with
+    "title", "tree", "leaf" and "history". Branches are kept for this
+    client's chats; other formats become a single branch.
+    """
+    if "chat" in obj and isinstance(obj["chat"], dict):  # Open WebUI export
+        obj = dict(obj["chat"], title=obj.get("title") or obj["chat"].get("title"))
+    title = obj.get("title") or "Imported chat"
+    if "mapping" in obj:  # ChatGPT conversations.json
+        raw = _chatgpt_messages(obj["mapping"])
+    elif isinstance(obj.get("tree"), list):  # Saved chats and our JSONL archive
+        tree, leaf = _clean_tree(obj["tree"], obj.get("leaf", len(obj["tree"]) - 1))
+        return init_chat_tree({"title": title, "tree": tree, "leaf": leaf})
+    else:
+        raw = obj.get("history") or obj.get("messages") or []
+    history = [msg for msg in map(_clean_message, raw) if msg is not None]
+    return init_chat_tree({"title": title, "history": history})
+
+
+def _iter_chats(values):
+    """Groups decoded values into chats: this client's chat/message records or whole chat objects."""
+    chat = None
+    for obj in values:
+        if not isinstance(obj, dict):
+            continue
+        kind = obj.get("type")
+        if kind == "archive":
+            continue
+        if kind == "message":
+            if chat is None:
+                chat = {"title": "Imported chat", "history": []}
+            chat["tree" if "tree" in chat else "history"].append(obj)
+            continue
+        if chat is not None:
+            yield _normalize_chat(chat)
+            chat = None
+        if kind == "chat":
+            if "leaf" in obj:  # A whole tree follows, each message with its parent
+                chat = {"title": obj.get("title"), "tree": [], "leaf": obj["leaf"]}
+            else:
+                chat = {"title": obj.get("title"), "history": []}
+        else:
+            yield _normalize_chat(obj)
+    if chat is not None:
+        yield _normalize_chat(chat)
+
+
+def iter_archive(path, progress=None):
+    """
+    Yields chats (see _normalize_chat) from an archive, parsing incrementally.
+    Supports this client's JSONL export and chat_histories.json, plain JSONL
+    or JSON arrays of chats, and the ChatGPT and Open WebUI JSON exports.
+    progress(bytes_read, total_bytes) is called after every chat.
+    """
+    total = os.path.getsize(path)
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        if not head:
+            return
+        for chat in _iter_chats(_iter_values(f, head)):
+            yield chat
+            if progress:
+                progress(min(f.buffer.tell(), total), total)
+    if progress:
+        progress(total, total)
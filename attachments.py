@@ -0,0 +1,105 @@
+import codecs
+import mmap
+import os
+import time
+import uuid
+
+from blob_store import put_blob, get_blob
+
+ATTACHMENT_DIR = "chat_attachments"
+SCAN_CHUNK = 4 * 1024 * 1024
+CHARS_PER_TOKEN = 4  # Rough estimate; good enough for budgeting
+TAIL_SHARE = 0.75  # Logs: the end is usually what matters
+
+
+def estimate_tokens(text_or_size):
+    size = text_or_size if isinstance(text_or_size, int) else len(text_or_size)
+    return (size + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _decode(data):
+    # An incremental decoder drops a multi-byte character cut at the slice edge
+    return codecs.getincrementaldecoder("utf-8")(errors="replace").decode(data, final=False)
+
+
+def ingest_file(path, token_budget, progress=None):
+    """
+    Scans a file through mmap in chunks and returns an attachment record.
+
+    The whole file is never loaded: lines are counted chunk by chunk, and if the
+    estimated token count exceeds token_budget only the head and tail that fit
+    are kept, with a marker for the omitted middle. The excerpt is stored in the
+    blob store and the record only references it.
+    """
+    size = os.path.getsize(path)
+    name = os.path.basename(path)
+    line_count = 0
+    excerpt = ""
+    if size:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start in range(0, size, SCAN_CHUNK):
+                line_count += mm[start:start + SCAN_CHUNK].count(b"\n")
+                if progress:
+                    progress(min(start + SCAN_CHUNK, size), size)
+            budget_bytes = max(0, token_budget) * CHARS_PER_TOKEN
+            if size <= budget_bytes:
+                excerpt = _decode(mm[:])
+            else:
+                tail_bytes = int(budget_bytes * TAIL_SHARE)
+                head_bytes = budget_bytes - tail_bytes
+                head = _decode(mm[:head_bytes])
+                tail = mm[size - tail_bytes:]
+                # Start the tail on a line boundary
+                newline = tail.find(b"\n")
+                if 0 <= newline < len(tail) - 1:
+                    tail = tail[newline + 1:]
+                tail = _decode(tail)
+                omitted = line_count - head.count("\n") - tail.count("\n")
+                excerpt = f"{head}\n[... {max(omitted, 0)} lines / {size - len(head) - len(tail)} bytes omitted ...]\n{tail}"
+    digest = put_blob(excerpt)
+    return {
+        "id": digest,
+        "name": name,
+        "size": size,
+        "lines": line_count,
+        "tokens": estimate_tokens(size),
+        "sent_tokens": estimate_tokens(excerpt),
+        "trimmed": len(excerpt.encode("utf-8")) < size,
+    }
+
+
+def save_pasted_text(text):
+    """Writes pasted text to a file under ATTACHMENT_DIR so it can be ingested like any file."""
+    os.makedirs(ATTACHMENT_DIR, exist_ok=True)
+    # The uuid keeps two pastes in the same second from overwriting each other
+    path = os.path.join(ATTACHMENT_DIR, f"pasted-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def attachment_text(att):
+    """The text sent to the model for an attachment."""
+    body = get_blob(att["id"]) or ""
+    return f"[Attachment: {att['name']}]\n```\n{body}\n```"
+
+
+def image_summary(att):
+    scaled = ""
+    if list(att.get("original") or []) != [att["width"], att["height"]]:
+        scaled = f", sent as {att['width']}×{att['height']}"
+    w, h = att.get("original") or (att["width"], att["height"])
+    return f"🖼 {att['name']} ({w}×{h}{scaled})"
+
+
+def attachment_summary(att):
+    """Short human-readable description for bubbles and the prompt area."""
+    if att.get("type") == "image":
+        return image_summary(att)
+    size = att["size"]
+    if size >= 1024 * 1024:
+        size_text = f"{size / (1024 * 1024):.1f} MB"
+    else:
+        size_text = f"{size / 1024:.0f} KB"
+    trimmed = f", trimmed to ~{att['sent_tokens']} tokens" if att.get("trimmed") else ""
+    return f"📎 {att['name']} ({size_text}, ~{att['tokens']} tokens{trimmed})"
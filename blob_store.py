@@ -0,0 +1,103 @@
+import hashlib
+import lzma
+import os
+import zlib
+from functools import lru_cache
+
+BLOB_DIR = "chat_blobs"
+INLINE_LIMIT = 2048  # Strings shorter than this stay inline in the message
+LZMA_THRESHOLD = 64 * 1024  # Big payloads (full HTML pages) get the stronger codec
+
+# Message fields that may be moved out of chat_histories.json
+BLOB_FIELDS = ("think_content",)
+
+
+def _blob_path(digest, ext):
+    return os.path.join(BLOB_DIR, digest[:2], digest[2:] + ext)
+
+
+def put_blob(text):
+    """
+    Stores text in the blob store and returns its sha256 digest.
+    Identical content is only ever written once.
+    """
+    data = text.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    if os.path.exists(_blob_path(digest, ".xz")) or os.path.exists(_blob_path(digest, ".z")):
+        return digest
+    if len(data) >= LZMA_THRESHOLD:
+        path, payload = _blob_path(digest, ".xz"), lzma.compress(data, preset=6)
+    else:
+        path, payload = _blob_path(digest, ".z"), zlib.compress(data, 6)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return digest
+
+
+@lru_cache(maxsize=64)
+def _load_blob(digest):
+    # A miss raises instead of returning None: lru_cache does not cache exceptions,
+    # so a blob that is written later (e.g. by an import) is found on the next call
+    for ext, decompress in ((".xz", lzma.decompress), (".z", zlib.decompress)):
+        path = _blob_path(digest, ext)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return decompress(f.read()).decode("utf-8")
+    raise KeyError(digest)
+
+
+def get_blob(digest):
+    """
+    Loads and decompresses a blob by digest. Returns None if it is missing.
+    Only found blobs are cached.
+    """
+    try:
+        return _load_blob(digest)
+    except KeyError:
+        return None
+
+
+get_blob.cache_clear = _load_blob.cache_clear
+
+
+def externalize_message(msg):
+    """
+    Moves large BLOB_FIELDS of a message dict into the blob store in place,
+    leaving a "<field>_blob" digest behind. Returns the message.
+    """
+    for field in BLOB_FIELDS:
+        value = msg.get(field)
+        if isinstance(value, str) and len(value) >= INLINE_LIMIT:
+            msg[field + "_blob"] = put_blob(value)
+            del msg[field]
+    return msg
+
+
+def message_field(msg, field):
+    """
+    Returns a message field, loading it from the blob store if it was externalized.
+    """
+    if field in msg:
+        return msg[field]
+    digest = msg.get(field + "_blob")
+    return get_blob(digest) if digest else None
+
+
+def resolve_message(msg):
+    """
+    Returns a copy of a message with every blob reference loaded inline, for display.
+    """
+    resolved = {k: v for k, v in msg.items() if not k.endswith("_blob")}
+    for field in BLOB_FIELDS:
+        value = message_field(msg, field)
+        if value is not None:
+            resolved[field] = value
+    if "tool_results" in msg:
+        resolved["tool_results"] = [
+            {"name": r.get("name"), "content": message_field(r, "content")}
+            for r in msg["tool_results"]
+        ]
+    return resolved
@@ -0,0 +1,326 @@
+import cProfile
+import gc
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+DIAGNOSTICS_DIR = "diagnostics"
+
+# Class names whose live instances are worth watching for leaks
+TRACKED_CLASSES = ("ChatBubble", "QWebEngineView", "QWebEnginePage")
+
+_lock = threading.Lock()
+_profiling_enabled = False
+_section_stats = {}  # section name -> pstats.Stats accumulated over all runs
+_section_calls = {}  # section name -> (run count, total wall seconds)
+_snapshots = []
+_watchdog = None
+_chat_loads = deque(maxlen=20)  # (bubbles, layout passes, scrolls) of recent chat loads
+
+STALL_BUCKETS_MS = (100, 250, 500, 1000, 2000, 5000)
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def set_profiling(enabled):
+    global _profiling_enabled
+    _profiling_enabled = enabled
+
+
+def profiling_enabled():
+    return _profiling_enabled
+
+
+@contextmanager
+def profiled(section):
+    """
+    Runs the body under cProfile when profiling is enabled and accumulates
+    the stats per section name. A no-op otherwise.
+    """
+    if not _profiling_enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active (nested section); time only
+        profiler = None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+        with _lock:
+            count, total = _section_calls.get(section, (0, 0.0))
+            _section_calls[section] = (count + 1, total + elapsed)
+            if profiler:
+                if section in _section_stats:
+                    _section_stats[section].add(profiler)
+                else:
+                    _section_stats[section] = pstats.Stats(profiler)
+
+
+def profile_summary(limit=15):
+    """Returns a text report of the accumulated stats for every section."""
+    out = io.StringIO()
+    with _lock:
+        if not _section_calls:
+            return "No profiled sections yet."
+        for section, (count, total) in sorted(_section_calls.items()):
+            out.write(f"== {section}: {count} runs, {total * 1000:.1f} ms total, {total * 1000 / count:.1f} ms avg\n")
+            stats = _section_stats.get(section)
+            if stats:
+                stats.stream = out
+                stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def reset_profiles():
+    with _lock:
+        _section_stats.clear()
+        _section_calls.clear()
+
+
+def dump_profiles(directory=None):
+    """Writes one .prof file per section plus a text summary; returns the written paths."""
+    directory = directory or DIAGNOSTICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    paths = []
+    with _lock:
+        for section, stats in _section_stats.items():
+            path = os.path.join(directory, f"profile_{section}_{stamp}.prof")
+            stats.dump_stats(path)
+            paths.append(path)
+    summary_path = os.path.join(directory, f"profile_summary_{stamp}.txt")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        f.write(profile_summary(limit=40))
+    paths.append(summary_path)
+    return paths
+
+
+def start_tracemalloc(frames=10):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def take_snapshot():
+    """Takes a tracemalloc snapshot (starting tracing if needed) and returns a short report."""
+    start_tracemalloc()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    _snapshots.append(snapshot)
+    current, peak = tracemalloc.get_traced_memory()
+    return f"Snapshot #{len(_snapshots)}: {current / 1024:.0f} KiB traced, peak {peak / 1024:.0f} KiB"
+
+
+def diff_snapshots(limit=20):
+    """Compares the last two snapshots and returns the top growth by source line."""
+    if len(_snapshots) < 2:
+        return "Need at least two snapshots to diff."
+    stats = _snapshots[-1].compare_to(_snapshots[-2], "lineno")
+    lines = [f"Top {limit} differences (snapshot #{len(_snapshots) - 1} -> #{len(_snapshots)}):"]
+    lines.extend(str(stat) for stat in stats[:limit])
+    return "\n".join(lines)
+
+
+def dump_snapshot(directory=None):
+    """Writes the latest snapshot to disk; returns its path or None."""
+    if not _snapshots:
+        return None
+    directory = directory or DIAGNOSTICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"tracemalloc_{time.strftime('%Y%m%d-%H%M%S')}.snapshot")
+    _snapshots[-1].dump(path)
+    return path
+
+
+def count_instances(class_names=TRACKED_CLASSES):
+    """
+    Counts Python wrappers of the given classes still reachable by the GC.
+    Wrappers whose C++ object is already gone (e.g. after deleteLater) are
+    reported separately, since those are Python-side leaks.
+    """
+    try:
+        from PyQt6 import sip
+        is_deleted = sip.isdeleted
+    except ImportError:
+        is_deleted = None
+    gc.collect()
+    counts = {name: [0, 0] for name in class_names}  # name -> [live, deleted]
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        if name in counts:
+            deleted = bool(is_deleted and is_deleted(obj))
+            counts[name][1 if deleted else 0] += 1
+    return {name: {"live": live, "deleted": deleted} for name, (live, deleted) in counts.items()}
+
+
+def instance_report():
+    lines = []
+    for name, c in count_instances().items():
+        lines.append(f"{name}: {c['live']} live, {c['deleted']} wrappers of deleted objects")
+    return "\n".join(lines)
+
+
+def run_profiled(section, func, *args, **kwargs):
+    with profiled(section):
+        return func(*args, **kwargs)
+
+
+def _locate(stack):
+    """(location, formatted stack) for a stall; blames the innermost frame in our own code."""
+    ours = [f for f in stack if os.path.abspath(f.filename).startswith(_PROJECT_DIR)]
+    culprit = (ours or list(stack))[-1]
+    location = f"{os.path.basename(culprit.filename)}:{culprit.lineno} {culprit.name}"
+    return location, "".join(traceback.format_list(stack))
+
+
+class StallWatchdog:
+    """
+    Detects GUI event-loop stalls.
+
+    The GUI thread calls heartbeat() from a repeating timer. A background
+    thread checks how long ago the last beat was; once that exceeds the
+    threshold it captures the GUI thread's Python stack with
+    sys._current_frames() and writes it to the log right away, so a hard
+    freeze that never recovers is still on disk. Longer stalls log again as
+    they cross each STALL_BUCKETS_MS bucket. The duration and histogram are
+    recorded when the next heartbeat arrives.
+    """
+
+    def __init__(self, threshold_ms=250, heartbeat_ms=100, log_path=None):
+        # Must be constructed on the GUI thread
+        self._gui_thread_id = threading.get_ident()
+        self._threshold = threshold_ms / 1000
+        self._heartbeat = heartbeat_ms / 1000
+        self._log_path = log_path
+        self._last_beat = time.monotonic()
+        self._stall_stack = None
+        self._stall_location = None
+        self._histogram = {bucket: 0 for bucket in STALL_BUCKETS_MS + (None,)}
+        self._offenders = {}  # location -> [count, total seconds, max seconds, formatted stack]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def heartbeat(self):
+        now = time.monotonic()
+        gap = now - self._last_beat
+        self._last_beat = now
+        stack = self._stall_stack
+        if stack is not None:
+            self._stall_stack = None
+            self._record(gap - self._heartbeat, stack)
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self):
+        poll = min(self._threshold, self._heartbeat) / 2
+        next_report = None  # Lag in ms at which an ongoing stall is logged again
+        while not self._stop.wait(poll):
+            beat = self._last_beat
+            lag = time.monotonic() - beat - self._heartbeat
+            if lag < self._threshold:
+                next_report = None
+                continue
+            if self._stall_stack is None:
+                frame = sys._current_frames().get(self._gui_thread_id)
+                if frame is None or self._last_beat != beat:
+                    continue  # Recovered while we looked
+                stack = traceback.extract_stack(frame)
+                location, formatted = _locate(stack)
+                self._stall_location = location
+                self._stall_stack = stack
+                self._log(f"stall in progress, {lag * 1000:.0f} ms so far in {location}", formatted)
+                next_report = next((b for b in STALL_BUCKETS_MS if b > lag * 1000), None)
+            elif next_report is not None and lag * 1000 >= next_report:
+                self._log(f"still stalled after {lag * 1000:.0f} ms in {self._stall_location}")
+                next_report = next((b for b in STALL_BUCKETS_MS if b > lag * 1000), None)
+
+    def _log(self, message, stack_text=None):
+        print(f"GUI {message}")
+        if not self._log_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._log_path) or ".", exist_ok=True)
+            with open(self._log_path, "a", encoding="utf-8") as f:
+                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}\n")
+                if stack_text:
+                    f.write(stack_text + "\n")
+        except OSError as e:
+            print(f"Error writing stall log: {e}")
+
+    def _record(self, duration, stack):
+        duration_ms = duration * 1000
+        bucket = next((b for b in STALL_BUCKETS_MS if duration_ms < b), None)
+        location, formatted = _locate(stack)
+        with self._lock:
+            self._histogram[bucket] += 1
+            entry = self._offenders.setdefault(location, [0, 0.0, 0.0, formatted])
+            entry[0] += 1
+            entry[1] += duration
+            if duration > entry[2]:
+                entry[2], entry[3] = duration, formatted
+        # The stack was logged when the stall was detected
+        self._log(f"stall recovered after {duration_ms:.0f} ms in {location}")
+
+    def report(self, limit=10):
+        with self._lock:
+            lines = [f"Stall threshold {self._threshold * 1000:.0f} ms. Duration histogram:"]
+            lower = 0
+            for bucket, count in self._histogram.items():
+                label = f"{lower}-{bucket} ms" if bucket else f">= {lower} ms"
+                lines.append(f"  {label:>14}: {count}")
+                lower = bucket or lower
+            lines.append("")
+            lines.append("Worst offenders (by total stalled time):")
+            offenders = sorted(self._offenders.items(), key=lambda kv: kv[1][1], reverse=True)[:limit]
+            if not offenders:
+                lines.append("  none")
+            for location, (count, total, worst, stack) in offenders:
+                lines.append(f"  {location}: {count} stalls, {total * 1000:.0f} ms total, worst {worst * 1000:.0f} ms")
+            if offenders:
+                lines.append("")
+                lines.append(f"Stack of the worst stall in {offenders[0][0]}:")
+                lines.append(offenders[0][1][3])
+        return "\n".join(lines)
+
+
+def start_stall_watchdog(threshold_ms, heartbeat_ms=100):
+    """Starts the process-wide watchdog (call on the GUI thread) and returns it."""
+    global _watchdog
+    if _watchdog is None:
+        _watchdog = StallWatchdog(threshold_ms, heartbeat_ms, os.path.join(DIAGNOSTICS_DIR, "stalls.log"))
+    return _watchdog
+
+
+def stall_report():
+    if _watchdog is None:
+        return "Stall watchdog is not running."
+    return _watchdog.report()
+
+
+def record_chat_load(bubbles, layout_passes, scrolls):
+    _chat_loads.append((bubbles, layout_passes, scrolls))
+
+
+def chat_load_report():
+    if not _chat_loads:
+        return "No chat loads recorded yet."
+    lines = ["Recent chat loads (newest last):"]
+    lines += [f"  {b} bubbles, {l} layout passes, {s} scrolls" for b, l, s in _chat_loads]
+    return "\n".join(lines)
@@ -0,0 +1,94 @@
+import base64
+import hashlib
+import os
+import threading
+
+from PyQt6 import QtCore, QtGui
+
+from blob_store import put_blob, get_blob
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp")
+DEFAULT_IMAGE_SIDE = 1024  # Used when the model does not report its vision input size
+THUMBNAIL_SIDE = 96
+JPEG_QUALITY = 85
+
+# (source digest, max side) -> image record; the same picture dropped twice is encoded once
+_prepared = {}
+_prepared_lock = threading.Lock()
+_thumbnails = {}  # thumbnail blob digest -> QPixmap, GUI thread only
+
+
+def is_image_path(path):
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _encode(image, fmt):
+    buffer = QtCore.QBuffer()
+    buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, fmt, JPEG_QUALITY if fmt == "JPEG" else -1)
+    return base64.b64encode(bytes(buffer.data())).decode("ascii")
+
+
+def prepare_image(data, name, max_side=DEFAULT_IMAGE_SIDE):
+    """
+    Downscales image bytes to fit max_side, base64-encodes the result and a
+    thumbnail, and stores both in the blob store. Returns an attachment record
+    referencing them; the history never holds image data itself.
+
+    Uses QImage only, so it is safe to call from a worker thread.
+    """
+    source = hashlib.sha256(data).hexdigest()
+    key = (source, max_side)
+    with _prepared_lock:
+        cached = _prepared.get(key)
+    if cached:
+        return dict(cached, name=name)
+    image = QtGui.QImage.fromData(data)
+    if image.isNull():
+        raise ValueError(f"{name} is not a supported image")
+    original = (image.width(), image.height())
+    if max(original) > max_side:
+        image = image.scaled(
+            max_side, max_side,
+            QtCore.Qt.AspectRatioMode.KeepAspectRatio,
+            QtCore.Qt.TransformationMode.SmoothTransformation,
+        )
+    # JPEG is much smaller for photos; keep PNG when transparency matters
+    fmt = "PNG" if image.hasAlphaChannel() else "JPEG"
+    thumb = image.scaled(
+        THUMBNAIL_SIDE, THUMBNAIL_SIDE,
+        QtCore.Qt.AspectRatioMode.KeepAspectRatio,
+        QtCore.Qt.TransformationMode.SmoothTransformation,
+    )
+    record = {
+        "type": "image",
+        "id": put_blob(_encode(image, fmt)),
+        "thumbnail": put_blob(_encode(thumb, "PNG")),
+        "name": name,
+        "size": len(data),
+        "width": image.width(),
+        "height": image.height(),
+        "original": list(original),
+    }
+    with _prepared_lock:
+        _prepared[key] = record
+    return dict(record)
+
+
+def image_data(att):
+    """The base64 string sent in a message's images list."""
+    return get_blob(att["id"])
+
+
+def thumbnail_pixmap(att):
+    """QPixmap of an image attachment's thumbnail, decoded once per session."""
+    digest = att.get("thumbnail")
+    pixmap = _thumbnails.get(digest)
+    if pixmap is None:
+        pixmap = QtGui.QPixmap()
+        encoded = get_blob(digest) if digest else None
+        if encoded:
+            pixmap.loadFromData(base64.b64decode(encoded))
+        _thumbnails[digest] = pixmap
+    return pixmap
+
@@ -0,0 +1,153 @@
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+
+JOURNAL_DIR = "request_journal"
+MAX_SEGMENT_BYTES = 8 * 1024 * 1024
+MAX_SEGMENTS = 8  # Oldest segments are deleted beyond this
+
+_FRAME_HEADER = struct.Struct(">I")
+
+
+def _json_default(obj):
+    # Ollama responses are pydantic models; fall back to str for anything else
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "dict"):
+        try:
+            return obj.dict()
+        except TypeError:
+            pass
+    return str(obj)
+
+
+class RequestJournal:
+    """
+    Append-only, size-rotated journal of request/response records.
+
+    Each record is zlib-compressed and framed with a 4-byte length in a segment
+    file. index.jsonl maps message ids to (segment, offset) so a record is read
+    back with a single seek. Writes happen on a background thread.
+    """
+
+    def __init__(self, directory=JOURNAL_DIR, max_segment_bytes=MAX_SEGMENT_BYTES, max_segments=MAX_SEGMENTS):
+        self._dir = directory
+        self._max_segment_bytes = max_segment_bytes
+        self._max_segments = max_segments
+        self._index_path = os.path.join(directory, "index.jsonl")
+        self._index = None  # Loaded lazily on first read
+        self._pending = {}  # id -> record, until the writer has stored it
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def append(self, msg_id, record):
+        """Queues a record for writing; returns immediately."""
+        with self._lock:
+            self._pending[msg_id] = record
+        self._queue.put((msg_id, record))
+
+    def read(self, msg_id):
+        """Returns the record for msg_id, or None if it is unknown or rotated away."""
+        with self._lock:
+            if msg_id in self._pending:
+                return json.loads(json.dumps(self._pending[msg_id], default=_json_default))
+            if self._index is None:
+                self._index = self._load_index()
+            entry = self._index.get(msg_id)
+        if not entry:
+            return None
+        segment, offset = entry
+        try:
+            with open(self._segment_path(segment), "rb") as f:
+                f.seek(offset)
+                (length,) = _FRAME_HEADER.unpack(f.read(_FRAME_HEADER.size))
+                return json.loads(zlib.decompress(f.read(length)).decode("utf-8"))
+        except (OSError, struct.error, zlib.error, ValueError):
+            return None
+
+    def close(self):
+        """Flushes queued records and stops the writer thread."""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _segment_path(self, segment):
+        return os.path.join(self._dir, f"segment-{segment:06d}.log")
+
+    def _segments(self):
+        if not os.path.isdir(self._dir):
+            return []
+        numbers = []
+        for name in os.listdir(self._dir):
+            if name.startswith("segment-") and name.endswith(".log"):
+                try:
+                    numbers.append(int(name[len("segment-"):-len(".log")]))
+                except ValueError:
+                    pass
+        return sorted(numbers)
+
+    def _load_index(self):
+        index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn line from a crash
+                    index[entry["id"]] = (entry["segment"], entry["offset"])
+        return index
+
+    def _writer(self):
+        segments = self._segments()
+        segment = segments[-1] if segments else 1
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            msg_id, record = item
+            try:
+                os.makedirs(self._dir, exist_ok=True)
+                path = self._segment_path(segment)
+                if os.path.exists(path) and os.path.getsize(path) >= self._max_segment_bytes:
+                    segment += 1
+                    path = self._segment_path(segment)
+                    self._drop_old_segments(segment)
+                payload = zlib.compress(json.dumps(record, ensure_ascii=False, default=_json_default).encode("utf-8"), 6)
+                with open(path, "ab") as f:
+                    offset = f.tell()
+                    f.write(_FRAME_HEADER.pack(len(payload)))
+                    f.write(payload)
+                with open(self._index_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"id": msg_id, "segment": segment, "offset": offset}) + "\n")
+                with self._lock:
+                    if self._index is not None:
+                        self._index[msg_id] = (segment, offset)
+            except Exception as e:
+                print(f"Error writing request journal: {e}")
+            finally:
+                with self._lock:
+                    self._pending.pop(msg_id, None)
+
+    def _drop_old_segments(self, newest):
+        """Deletes segments beyond max_segments and rewrites the index without them."""
+        keep_from = newest - self._max_segments + 1
+        dropped = [s for s in self._segments() if s < keep_from]
+        if not dropped:
+            return
+        for s in dropped:
+            os.remove(self._segment_path(s))
+        with self._lock:
+            index = self._index if self._index is not None else self._load_index()
+            index = {k: v for k, v in index.items() if v[0] >= keep_from}
+            tmp_path = self._index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for msg_id, (segment, offset) in index.items():
+                    f.write(json.dumps({"id": msg_id, "segment": segment, "offset": offset}) + "\n")
+            os.replace(tmp_path, self._index_path)
+            if self._index is not None:
+                self._index = index
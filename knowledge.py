@@ -0,0 +1,310 @@
+import array
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import operator
+import os
+import re
+import threading
+import time
+
+from attachments import estimate_tokens
+
+KNOWLEDGE_DIR = "knowledge_index"
+TEXT_EXTENSIONS = (".txt", ".md", ".rst", ".py", ".json", ".csv", ".log", ".html", ".xml", ".yaml", ".yml", ".ini", ".cfg", ".toml")
+MAX_FILE_BYTES = 5 * 1024 * 1024  # Bigger files are skipped; attach them instead
+CHUNK_CHARS = 1500
+CHUNK_OVERLAP = 200
+EMBED_BATCH = 32
+DEFAULT_TOP_K = 4
+DEFAULT_TOKEN_BUDGET = 1500
+
+_WORD = re.compile(r"\w+")
+
+
+def chunk_text(text, size=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """Splits text into overlapping chunks, preferring to cut at line breaks."""
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            cut = text.rfind("\n", start + size // 2, end)
+            if cut > 0:
+                end = cut
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class HashingEmbedder:
+    """
+    Local stand-in embedding backend: hashed bag of words, no model or server
+    needed. Only lexical, but deterministic and fast, so indexing and retrieval
+    can be exercised offline.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dim
+            for word in _WORD.findall(text.lower()):
+                h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest(), "little")
+                vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+            vectors.append(vector)
+        return vectors
+
+
+class OllamaEmbedder:
+    """Embeds through the Ollama server's embed endpoint."""
+
+    def __init__(self, client_factory, model):
+        self._client_factory = client_factory
+        self.model = model
+        self.name = f"ollama:{model}"
+
+    def embed(self, texts):
+        return [list(v) for v in self._client_factory().embed(model=self.model, input=texts)["embeddings"]]
+
+
+class KnowledgeBase:
+    """
+    Chunked, embedded index of the text files under a folder.
+
+    The index lives in KNOWLEDGE_DIR/<hash of folder and embedder>/, so
+    profiles sharing a folder with different models keep separate indexes.
+    vectors.f32 holds one
+    normalized float32 row per chunk and is memory-mapped for search,
+    chunks.json holds the chunk texts and manifest.json the per-file mtimes
+    and row ranges. update() only re-embeds files that changed; rows of
+    unchanged files are copied over from the old index.
+    """
+
+    def __init__(self, folder, embedder):
+        self.folder = folder
+        self.embedder = embedder
+        key = hashlib.sha1(f"{os.path.abspath(folder)}\0{embedder.name}".encode("utf-8")).hexdigest()[:16]
+        self.index_dir = os.path.join(KNOWLEDGE_DIR, key)
+        self.last_latency_ms = None
+        self.last_update = None
+        self._lock = threading.Lock()  # Guards the loaded index
+        self._update_lock = threading.Lock()  # One update at a time
+        self._updating = False  # An update_async() thread is running; guarded by _lock
+        self._manifest = None
+        self._chunks = None
+        self._file = None
+        self._mm = None
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def _load(self):
+        """Loads the manifest and maps the vectors; call with _lock held."""
+        if self._manifest is not None:
+            return
+        try:
+            with open(self._path("manifest.json"), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            with open(self._path("chunks.json"), "r", encoding="utf-8") as f:
+                chunks = json.load(f)
+        except (OSError, ValueError):
+            manifest, chunks = {"embedder": None, "dim": 0, "files": {}}, []
+        self._manifest, self._chunks = manifest, chunks
+        path = self._path("vectors.f32")
+        if chunks and os.path.exists(path) and os.path.getsize(path):
+            self._file = open(path, "rb")
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _unload(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+        self._manifest = self._chunks = self._file = self._mm = None
+
+    def close(self):
+        with self._lock:
+            self._unload()
+
+    def _scan(self):
+        files = {}
+        for root, dirs, names in os.walk(self.folder):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in names:
+                if not name.lower().endswith(TEXT_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_size <= MAX_FILE_BYTES:
+                    files[os.path.relpath(path, self.folder)] = (st.st_mtime, st.st_size)
+        return files
+
+    def update(self, progress=None):
+        """
+        Re-embeds new and changed files and drops removed ones.
+        Returns (files embedded, total chunks). progress(done, total) is called per file.
+        """
+        with self._update_lock:
+            start = time.perf_counter()
+            with self._lock:
+                self._load()
+                manifest, chunks, mm = self._manifest, self._chunks, self._mm
+            dim = manifest.get("dim", 0)
+            # Chunks without a vectors file cannot be copied over; embed everything again
+            rebuild = manifest.get("embedder") != self.embedder.name or (bool(chunks) and mm is None)
+            current = self._scan()
+            old_files = {} if rebuild else manifest["files"]
+            changed = [rel for rel, (mtime, size) in current.items()
+                       if rel not in old_files or old_files[rel]["mtime"] != mtime or old_files[rel]["size"] != size]
+            if not changed and set(old_files) == set(current):
+                self.last_update = (0, len(chunks), time.perf_counter() - start)
+                return 0, len(chunks)
+
+            os.makedirs(self.index_dir, exist_ok=True)
+            new_files, new_chunks = {}, []
+            tmp_vectors = self._path("vectors.f32.tmp")
+            with open(tmp_vectors, "wb") as out:
+                # Unchanged files keep their rows; only bytes are copied
+                for rel in sorted(set(current) - set(changed)):
+                    entry = old_files[rel]
+                    first, count = entry["first"], entry["count"]
+                    if count:  # Empty files have no rows (and an index of only those has no map)
+                        out.write(mm[first * dim * 4:(first + count) * dim * 4])
+                    new_files[rel] = dict(entry, first=len(new_chunks))
+                    new_chunks.extend(chunks[first:first + count])
+                for done, rel in enumerate(changed):
+                    try:
+                        with open(os.path.join(self.folder, rel), "r", encoding="utf-8", errors="replace") as f:
+                            pieces = chunk_text(f.read())
+                    except OSError as e:
+                        print(f"Knowledge base: cannot read {rel}: {e}")
+                        pieces = []
+                    first = len(new_chunks)
+                    for i in range(0, len(pieces), EMBED_BATCH):
+                        batch = pieces[i:i + EMBED_BATCH]
+                        for vector in self.embedder.embed(batch):
+                            if not dim or rebuild:
+                                dim, rebuild = len(vector), False
+                            out.write(array.array("f", _normalize(vector)).tobytes())
+                        new_chunks.extend([rel, text] for text in batch)
+                    mtime, size = current[rel]
+                    new_files[rel] = {"mtime": mtime, "size": size, "first": first, "count": len(new_chunks) - first}
+                    if progress:
+                        progress(done + 1, len(changed))
+
+            new_manifest = {"embedder": self.embedder.name, "dim": dim, "files": new_files}
+            with self._lock:
+                self._unload()  # The old mapping must be closed before its file is replaced
+                os.replace(tmp_vectors, self._path("vectors.f32"))
+                for name, data in (("chunks.json", new_chunks), ("manifest.json", new_manifest)):
+                    with open(self._path(name) + ".tmp", "w", encoding="utf-8") as f:
+                        json.dump(data, f, ensure_ascii=False)
+                    os.replace(self._path(name) + ".tmp", self._path(name))
+            self.last_update = (len(changed), len(new_chunks), time.perf_counter() - start)
+            return len(changed), len(new_chunks)
+
+    def update_async(self, on_done=None):
+        """
+        Runs update() on a worker thread. Returns False without starting one
+        if an earlier update_async() is still running.
+        """
+        with self._lock:
+            if self._updating:
+                return False
+            self._updating = True
+
+        def run():
+            try:
+                result = self.update()
+            except Exception as e:
+                print(f"Knowledge base update failed for {self.folder}: {e}")
+                result = None
+            finally:
+                with self._lock:
+                    self._updating = False
+            if on_done:
+                on_done(result)
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def search(self, query, top_k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET):
+        """
+        Returns up to top_k (score, file, text) chunks most similar to query,
+        best first, keeping their total estimated tokens under token_budget.
+        """
+        start = time.perf_counter()
+        query_vector = _normalize(self.embedder.embed([query])[0])
+        with self._lock:
+            self._load()
+            dim = self._manifest.get("dim", 0)
+            if self._mm is None or self._manifest.get("embedder") != self.embedder.name or len(query_vector) != dim:
+                return []
+            rows = len(self._chunks)
+            try:
+                import numpy  # Optional; the pure-Python scan below is fine for small indexes
+            except ImportError:
+                numpy = None
+            if numpy is not None:
+                matrix = numpy.frombuffer(self._mm, dtype=numpy.float32, count=rows * dim).reshape(rows, dim)
+                scores = matrix @ numpy.asarray(query_vector, dtype=numpy.float32)
+                best = numpy.argsort(-scores)[:top_k * 4]
+                ranked = [(float(scores[i]), int(i)) for i in best]
+                del matrix, scores  # Release the exported buffer so the map can be closed
+            else:
+                view = memoryview(self._mm).cast("f")
+                ranked = heapq.nlargest(
+                    top_k * 4,
+                    ((sum(map(operator.mul, query_vector, view[i * dim:(i + 1) * dim])), i) for i in range(rows)),
+                )
+                view.release()
+            results, used = [], 0
+            for score, i in ranked:
+                rel, text = self._chunks[i]
+                tokens = estimate_tokens(text)
+                if used + tokens > token_budget:
+                    continue
+                results.append((score, rel, text))
+                used += tokens
+                if len(results) >= top_k:
+                    break
+        self.last_latency_ms = (time.perf_counter() - start) * 1000
+        return results
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            files, chunks = len(self._manifest["files"]), len(self._chunks)
+        size = sum(
+            os.path.getsize(self._path(name)) for name in ("vectors.f32", "chunks.json", "manifest.json")
+            if os.path.exists(self._path(name))
+        )
+        return {"files": files, "chunks": chunks, "bytes": size, "last_latency_ms": self.last_latency_ms}
+
+    def describe(self):
+        s = self.stats()
+        text = f"{self.folder}: {s['files']} files, {s['chunks']} chunks, {s['bytes'] / (1024 * 1024):.1f} MB index"
+        if s["last_latency_ms"] is not None:
+            text += f", last search {s['last_latency_ms']:.1f} ms"
+        return text
+
+
+def knowledge_context(results):
+    """System message text for retrieved chunks."""
+    parts = [f"[{rel}]\n{text}" for _, rel, text in results]
+    return "Relevant excerpts from the knowledge base:\n\n" + "\n\n---\n\n".join(parts)
@@ -1,39 +1,141 @@
-from datetime import time
+import time
+_process_start = time.perf_counter()  # Cold-start reference point; keep this first
+
 import os
-import ollama
-import markdown
 import json
+import threading
+import uuid
 from PyQt6 import QtWidgets, QtCore, QtGui
-from PyQt6.QtWebEngineWidgets import QWebEngineView
 
 from tools import get_current_date, fetch_url_content
+from blob_store import put_blob, get_blob, externalize_message, resolve_message
+from messages import Message, init_chat_tree, append_message, fork, switch_branch, descend, leaf_has_children, branch_info, chat_to_dict
+import diagnostics
+from diagnostics import profiled
+from archive import export_jsonl, export_markdown, iter_archive
+from journal import RequestJournal
+from model_registry import ModelRegistry
+from attachments import ingest_file, save_pasted_text, attachment_text, attachment_summary, estimate_tokens
+from images import DEFAULT_IMAGE_SIDE, is_image_path, prepare_image, image_data, thumbnail_pixmap
+from renderer import MarkdownRenderer, render_markdown, plain_html, needs_async
+from knowledge import KnowledgeBase, HashingEmbedder, OllamaEmbedder, knowledge_context, DEFAULT_TOP_K, DEFAULT_TOKEN_BUDGET
 
 CONFIG_FILE = "client_config.json"
-CHAT_HISTORY_FILE = "chat_histories.json"  # <-- Add this line
-
-ollama_client = ollama.Client(host="http://servery:11434")
-try:
-    models_response = ollama_client.list()
-    models_list = models_response.get("models", [])
-    model_names = [m.model for m in models_list]
-except Exception as e:
-    model_names = []
-    print(f"Error fetching models: {e}")
-
-selected_model = model_names[0] if model_names else None
-system_prefix = "You are a helpful assistant."
-
-def make_json_safe(obj):
-    """Recursively convert unserializable objects to strings."""
-    if isinstance(obj, dict):
-        return {k: make_json_safe(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [make_json_safe(i) for i in obj]
+CHAT_HISTORY_FILE = "chat_histories.json"  # Single-file format of older versions; read once to migrate
+CHAT_DIR = "chats"  # One <chat id>.json per chat, so a save only rewrites the chats that changed
+CHAT_INDEX_FILE = os.path.join(CHAT_DIR, "index.json")  # Chat ids in list order
+
+OLLAMA_HOST = "http://servery:11434"
+DEFAULT_MAX_CONCURRENT_PER_HOST = 2
+DEFAULT_NUM_CTX_LIMIT = 8192  # Upper bound for num_ctx; the model's own context length caps it further
+DEFAULT_STALL_THRESHOLD_MS = 250  # 0 disables the event-loop stall watchdog
+LARGE_PASTE_CHARS = 20000  # Pastes bigger than this become attachments instead of prompt text
+REPLY_CONTEXT_SHARE = 0.25  # Part of num_ctx an attachment never takes, left for the reply
+MIN_ATTACHMENT_TOKENS = 256  # An attachment keeps at least this much even when the context is full
+DEFAULT_COLD_START_TARGET_MS = 1500
+KNOWLEDGE_RESCAN_MS = 60000  # How often profile knowledge folders are checked for changed files
+
+# "webengine" renders bubbles with Chromium; "textbrowser" uses QTextBrowser and never loads it
+RENDERERS = ("webengine", "textbrowser")
+renderer_backend = "webengine"
+
+# Renderer pool worker processes (spawn start method) re-import this module as
+# __mp_main__; they must not open the journal or start their own pools.
+IS_WORKER_PROCESS = __name__ == "__mp_main__"
+
+# Filled in by fetch_models() on a background thread once the window is up
+models_list = []
+model_names = []
+selected_model = None
+
+class HostLimiter:
+    """Limits concurrent requests to one Ollama host. Use as a context manager; the limit can change at runtime."""
+
+    def __init__(self, limit):
+        self._cond = threading.Condition()
+        self._limit = max(1, limit)
+        self._active = 0
+
+    def set_limit(self, limit):
+        with self._cond:
+            self._limit = max(1, limit)
+            self._cond.notify_all()
+
+    def __enter__(self):
+        with self._cond:
+            while self._active >= self._limit:
+                self._cond.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+
+def get_host_limiter(host, limit=None):
+    """The shared HostLimiter for a host; passing limit updates it."""
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None:
+            limiter = _host_limiters[host] = HostLimiter(limit or DEFAULT_MAX_CONCURRENT_PER_HOST)
+        elif limit:
+            limiter.set_limit(limit)
+        return limiter
+
+class LimitedClient:
+    """
+    Wraps an ollama.Client so every call holds the host's HostLimiter;
+    streaming calls hold it until the stream ends. Callers that already hold
+    the limiter use .unlimited.
+    """
+
+    def __init__(self, client, limiter):
+        self.unlimited = client
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self.unlimited, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if kwargs.get("stream"):
+                return self._stream(attr, args, kwargs)
+            with self._limiter:
+                return attr(*args, **kwargs)
+        return call
+
+    def _stream(self, method, args, kwargs):
+        with self._limiter:
+            yield from method(*args, **kwargs)
+
+_ollama_client = None
+_ollama_client_lock = threading.Lock()
+
+def get_ollama_client():
+    """The shared, host-limited Ollama client; ollama (and httpx) are only imported on first use."""
+    global _ollama_client
+    with _ollama_client_lock:
+        if _ollama_client is None:
+            import ollama
+            _ollama_client = LimitedClient(ollama.Client(host=OLLAMA_HOST), get_host_limiter(OLLAMA_HOST))
+        return _ollama_client
+
+def fetch_models():
+    """Lists the server's models; returns an empty list (and prints) on failure."""
     try:
-        json.dumps(obj)
-        return obj
-    except Exception:
-        return str(obj)
+        return list(get_ollama_client().list().get("models", []))
+    except Exception as e:
+        print(f"Error fetching models: {e}")
+        return []
+
+request_journal = RequestJournal() if not IS_WORKER_PROCESS else None
+markdown_renderer = MarkdownRenderer() if not IS_WORKER_PROCESS else None
+system_prefix = "You are a helpful assistant."
 
 def load_config():
     if os.path.exists(CONFIG_FILE):
@@ -45,29 +147,122 @@ def save_config(config):
     with open(CONFIG_FILE, "w") as f:
         json.dump(config, f)
 
+def _init_loaded_chat(hist):
+    init_chat_tree(hist)
+    # Move large inline payloads from older files into the blob store
+    for msg in hist["tree"]:
+        externalize_message(msg)
+    return hist
+
 def load_chat_histories():
+    if os.path.exists(CHAT_INDEX_FILE):
+        try:
+            with open(CHAT_INDEX_FILE, "r", encoding="utf-8") as f:
+                chat_ids = json.load(f)
+        except Exception as e:
+            print(f"Error loading chat index: {e}")
+            return []
+        histories = []
+        for chat_id in chat_ids:
+            try:
+                with open(_chat_path(chat_id), "r", encoding="utf-8") as f:
+                    hist = _init_loaded_chat(json.load(f))
+            except Exception as e:
+                print(f"Error loading chat {chat_id}: {e}")
+                continue
+            hist["id"] = chat_id
+            _saved_chats[chat_id] = _chat_signature(hist)
+            histories.append(hist)
+        _saved_index[:] = chat_ids
+        return histories
     if os.path.exists(CHAT_HISTORY_FILE):
+        # Older single-file format; the first save writes it out as per-chat files
         try:
             with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as f:
                 content = f.read().strip()
                 if not content:
                     return []
-                return json.loads(content)
+                return [_init_loaded_chat(hist) for hist in json.loads(content)]
         except Exception as e:
             print(f"Error loading chat histories: {e}")
     return []
 
+def _file_attachments(msg):
+    return [att for att in msg.get("attachments") or [] if att.get("type") != "image"]
+
+def message_images(msg):
+    """Image attachment records of a message; sent via "images", shown as thumbnails."""
+    return [att for att in msg.get("attachments") or [] if att.get("type") == "image"]
+
+def message_content(msg):
+    """Content sent to the model for a history message, with attachments expanded."""
+    attachments = _file_attachments(msg)
+    if not attachments:
+        return msg["content"]
+    return "\n\n".join([msg["content"]] + [attachment_text(att) for att in attachments]).strip()
+
+def request_message(msg):
+    """A history message as sent to Ollama."""
+    out = {"role": msg["role"], "content": message_content(msg)}
+    images = message_images(msg)
+    if images:
+        # Encoded once at attach time; the blob cache makes re-sending cheap
+        out["images"] = [image_data(att) for att in images]
+    return out
+
+def bubble_text(msg):
+    """Text shown in a chat bubble: the content plus one line per file attachment."""
+    attachments = _file_attachments(msg)
+    if not attachments:
+        return msg["content"]
+    return "\n\n".join([msg["content"]] + ["  \n".join(attachment_summary(att) for att in attachments)]).strip()
+
+_saved_chats = {}  # chat id -> signature of the chat as last written
+_saved_index = []  # chat ids as last written to CHAT_INDEX_FILE
+
+def _chat_path(chat_id):
+    return os.path.join(CHAT_DIR, f"{chat_id}.json")
+
+def _chat_signature(hist):
+    # Messages are never edited after they are added, so tree size, leaf and title identify a change
+    return (len(hist["tree"]), hist.get("leaf"), hist.get("title"))
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
 def save_chat_histories(histories):
+    """Writes the chats that changed since the last save, then the index if the list changed."""
     try:
-        # Make all histories JSON safe
-        safe_histories = make_json_safe(histories)
-        with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(safe_histories, f, ensure_ascii=False, indent=2)
+        with profiled("save"):
+            os.makedirs(CHAT_DIR, exist_ok=True)
+            chat_ids = []
+            for hist in histories:
+                chat_id = hist.setdefault("id", uuid.uuid4().hex)
+                chat_ids.append(chat_id)
+                signature = _chat_signature(hist)
+                if _saved_chats.get(chat_id) != signature:
+                    _write_json(_chat_path(chat_id), chat_to_dict(hist))
+                    _saved_chats[chat_id] = signature
+            if chat_ids != _saved_index:
+                _write_json(CHAT_INDEX_FILE, chat_ids)
+                # Chat files are removed only after the index no longer lists them
+                for chat_id in set(_saved_index) - set(chat_ids):
+                    _saved_chats.pop(chat_id, None)
+                    try:
+                        os.remove(_chat_path(chat_id))
+                    except OSError as e:
+                        print(f"Error removing chat file {chat_id}: {e}")
+                _saved_index[:] = chat_ids
     except Exception as e:
         print(f"Error saving chat histories: {e}")
 
 class ChatBubble(QtWidgets.QWidget):
-    def __init__(self, message, role="assistant", think_content=None, last_json=None, parent=None, on_height_ready=None):
+    html_ready_signal = QtCore.pyqtSignal(str, bool)  # rendered body, more highlighting pending
+
+    def __init__(self, message, role="assistant", think_content=None, last_json=None, parent=None, on_height_ready=None, think_blob=None, request_height=None, message_id=None, images=None, branch=None, on_branch=None, continues=False):
         super().__init__(parent)
         layout = QtWidgets.QHBoxLayout(self)
         layout.setContentsMargins(8, 2, 8, 2)
@@ -98,8 +293,9 @@ class ChatBubble(QtWidgets.QWidget):
         bubble_layout.setContentsMargins(8, 4, 8, 4)
         bubble_layout.setSpacing(2)
 
-        import re
-        html = markdown.markdown(message, extensions=["tables", "fenced_code", "codehilite"])
+        # Long messages and code render on markdown_renderer; plain text is shown meanwhile
+        render_async = needs_async(message)
+        html = plain_html(message) if render_async else render_markdown(message)[0]
         web_bg = bubble_color
         css = f"""
         <style>
@@ -110,53 +306,85 @@ class ChatBubble(QtWidgets.QWidget):
         th, td {{ border: 1px solid #ccc; padding: 4px 8px; }}
         </style>
         """
+        self._css = css
         html = f"<!DOCTYPE html><html><head>{css}</head><body>{html}</body></html>"
 
-        webview = QWebEngineView()
-        webview.setHtml(html)
-        webview.setMaximumWidth(480)
-
         # Set initial height to one text row
         font = QtGui.QFont("Segoe UI", 13)
         metrics = QtGui.QFontMetrics(font)
         one_row_height = metrics.lineSpacing() + 8  # +8 for padding
-        webview.setMinimumHeight(one_row_height)
-        webview.setMaximumHeight(one_row_height)
-        webview.setFixedHeight(one_row_height)
-        webview.setSizePolicy(QtWidgets.QSizePolicy.Policy.Preferred, QtWidgets.QSizePolicy.Policy.Minimum)
-        webview.setStyleSheet("background: transparent; border: none;")
-        webview.page().setBackgroundColor(QtGui.QColor(web_bg))
-        bubble_layout.addWidget(webview)
+        self._one_row_height = one_row_height
+        self._request_height = request_height
+        self._load_reported = False  # Set by the layout once this bubble's first load is counted
 
-        # Adjust height after content loads
-        def adjust_height():
-            def set_height():
-                webview.page().runJavaScript(
-                    """
-                    (function() {
-                        var body = document.body, html = document.documentElement;
-                        return Math.max(
-                            body.scrollHeight, body.offsetHeight, 
-                            html.clientHeight, html.scrollHeight, html.offsetHeight
-                        );
-                    })();
-                    """,
-                    lambda h: (
-                        webview.setMinimumHeight(one_row_height),
-                        webview.setMaximumHeight(16777215),
-                        webview.setFixedHeight(int(h) + 8 if h and int(h) > 0 else one_row_height),
-                        on_height_ready() if on_height_ready else None
-                    )
-                )
-            try:
-                webview.loadFinished.disconnect()
-            except Exception:
-                pass
-            webview.loadFinished.connect(lambda _: QtCore.QTimer.singleShot(50, set_height))
-        QtCore.QTimer.singleShot(0, adjust_height)
+        self._use_webengine = renderer_backend == "webengine"
+        if self._use_webengine:
+            self._init_webview(html, web_bg, bubble_layout, request_height, on_height_ready)
+        else:
+            # QTextBrowser path: no Chromium, and the height is known synchronously
+            browser = QtWidgets.QTextBrowser()
+            browser.setOpenExternalLinks(True)
+            browser.setMaximumWidth(480)
+            browser.setFrameShape(QtWidgets.QFrame.Shape.NoFrame)
+            browser.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+            browser.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+            browser.setStyleSheet(f"background: {web_bg}; border: none;")
+            browser.setFixedHeight(one_row_height)
+            browser.document().documentLayout().documentSizeChanged.connect(
+                lambda size: browser.setFixedHeight(max(one_row_height, int(size.height()) + 8))
+            )
+            browser.setHtml(html)
+            bubble_layout.addWidget(browser)
+            self._webview = browser
+            if request_height:
+                QtCore.QTimer.singleShot(0, lambda: request_height(self))
+            elif on_height_ready:
+                QtCore.QTimer.singleShot(0, on_height_ready)
+
+        if images:
+            thumbs = QtWidgets.QHBoxLayout()
+            thumbs.setSpacing(4)
+            for att in images:
+                thumb = QtWidgets.QLabel()
+                thumb.setPixmap(thumbnail_pixmap(att))
+                thumb.setStyleSheet("border: none;")
+                thumb.setToolTip(attachment_summary(att))
+                thumbs.addWidget(thumb)
+            thumbs.addStretch(1)
+            bubble_layout.addLayout(thumbs)
+
+        # Branch navigator for messages that have alternatives, or that a branch continues past
+        nav_parts = []
+        if branch and branch[1] > 1:
+            nav_parts.append(f'<a href="prev">‹</a> {branch[0]}/{branch[1]} <a href="next">›</a>')
+        if continues:
+            nav_parts.append('<a href="down">more ›</a>')
+        if nav_parts and on_branch:
+            nav = QtWidgets.QLabel(" · ".join(nav_parts))
+            nav.setStyleSheet("border: none; color: #777;")
+            nav.setToolTip("Switch between branches of this conversation")
+            nav.linkActivated.connect(on_branch)
+            bubble_layout.addWidget(nav, 0, QtCore.Qt.AlignmentFlag.AlignRight)
+
+        # Right-click on the icon forks the conversation at this message
+        if on_branch:
+            def show_branch_menu(pos):
+                menu = QtWidgets.QMenu(self)
+                if role == "user":
+                    menu.addAction("Edit and resend", lambda: on_branch("edit"))
+                else:
+                    menu.addAction("Retry", lambda: on_branch("retry"))
+                menu.exec(icon_label.mapToGlobal(pos))
+            icon_label.setContextMenuPolicy(QtCore.Qt.ContextMenuPolicy.CustomContextMenu)
+            icon_label.customContextMenuRequested.connect(show_branch_menu)
+
+        if render_async:
+            self._message = message
+            self.html_ready_signal.connect(self._swap_html)
+            self._submit_render(lazy_code=True)
 
         # Tooltip for think_content
-        if think_content and role == "assistant":
+        if (think_content or think_blob) and role == "assistant":
             self._tooltip_timer = None
 
             def show_custom_tooltip(event):
@@ -167,10 +395,12 @@ class ChatBubble(QtWidgets.QWidget):
 
                 def actually_show():
                     if icon_label.underMouse():
+                        # Externalized think content is only loaded when the tooltip is shown
+                        text = think_content if think_content is not None else get_blob(think_blob)
                         global_pos = QtGui.QCursor.pos() + QtCore.QPoint(24, 12)
                         QtWidgets.QToolTip.showText(
                             global_pos,
-                            f'<div style="max-width:180px;white-space:pre-wrap;">{think_content}</div>',
+                            f'<div style="max-width:180px;white-space:pre-wrap;">{text}</div>',
                             icon_label
                         )
                 self._tooltip_timer = QtCore.QTimer()
@@ -198,16 +428,30 @@ class ChatBubble(QtWidgets.QWidget):
                 dlg.resize(700, 500)
                 layout = QtWidgets.QVBoxLayout(dlg)
                 tabs = QtWidgets.QTabWidget()
+                # Records live in the request journal; read this one only now
+                record = last_json
+                if record is None and message_id:
+                    record = request_journal.read(message_id)
                 # Show request/response if available
-                if last_json and isinstance(last_json, dict):
+                if record and isinstance(record, dict):
                     req_text = QtWidgets.QPlainTextEdit()
                     req_text.setReadOnly(True)
-                    req_text.setPlainText(json.dumps(last_json.get("request", {}), indent=2, ensure_ascii=False))
+                    req_text.setPlainText(json.dumps(record.get("request", {}), indent=2, ensure_ascii=False, default=str))
                     tabs.addTab(req_text, "Request")
                     resp_text = QtWidgets.QPlainTextEdit()
                     resp_text.setReadOnly(True)
-                    resp_text.setPlainText(json.dumps(last_json.get("response", {}), indent=2, ensure_ascii=False))
+                    resp_text.setPlainText(json.dumps(record.get("response", {}), indent=2, ensure_ascii=False, default=str))
                     tabs.addTab(resp_text, "Response")
+                    if record.get("tool_response"):
+                        tool_text = QtWidgets.QPlainTextEdit()
+                        tool_text.setReadOnly(True)
+                        tool_text.setPlainText(json.dumps(record["tool_response"], indent=2, ensure_ascii=False, default=str))
+                        tabs.addTab(tool_text, "Tool Response")
+                    if record.get("retrieval"):
+                        retrieval_text = QtWidgets.QPlainTextEdit()
+                        retrieval_text.setReadOnly(True)
+                        retrieval_text.setPlainText(json.dumps(record["retrieval"], indent=2, ensure_ascii=False, default=str))
+                        tabs.addTab(retrieval_text, "Retrieval")
                 else:
                     info = QtWidgets.QLabel("No request/response data available for this message.")
                     layout.addWidget(info)
@@ -216,7 +460,6 @@ class ChatBubble(QtWidgets.QWidget):
                 btn.clicked.connect(dlg.accept)
                 layout.addWidget(btn)
                 dlg.exec()
-            icon_label.mouseDoubleClickEvent = show_response_dialog
 
         # --- Double-click event for assistant icon to show chat history for that response ---
         if role == "assistant":
@@ -243,9 +486,10 @@ class ChatBubble(QtWidgets.QWidget):
                             msg.get("role") == "assistant"
                             and msg.get("content") == message
                             and (think_content is None or msg.get("think_content") == think_content)
+                            and (think_blob is None or msg.get("think_content_blob") == think_blob)
                         ):
-                            # Show all messages up to and including this one
-                            history_to_show = chat_history[: i + 1]
+                            # Show all messages up to and including this one, with blobs loaded
+                            history_to_show = [resolve_message(m) for m in chat_history[: i + 1]]
                             history_str = json.dumps(history_to_show, indent=2, ensure_ascii=False)
                             break
                     else:
@@ -259,7 +503,14 @@ class ChatBubble(QtWidgets.QWidget):
                 btn.clicked.connect(dlg.accept)
                 layout.addWidget(btn)
                 dlg.exec()
-            icon_label.mouseDoubleClickEvent = show_history_dialog
+
+            # Double-click shows the request/response, Shift+double-click the history
+            def on_icon_double_click(event):
+                if event.modifiers() & QtCore.Qt.KeyboardModifier.ShiftModifier:
+                    show_history_dialog(event)
+                else:
+                    show_response_dialog(event)
+            icon_label.mouseDoubleClickEvent = on_icon_double_click
 
         if role == "user":
             layout.addStretch()
@@ -270,104 +521,352 @@ class ChatBubble(QtWidgets.QWidget):
             layout.addWidget(bubble)
             layout.addStretch()
 
-class ChatHistoryListWidget(QtWidgets.QListWidget):
-    """Custom QListWidget to support trash icon for each item."""
-    delete_chat_signal = QtCore.pyqtSignal(int)
+    def _init_webview(self, html, web_bg, bubble_layout, request_height, on_height_ready):
+        # Imported here so Chromium is only loaded once the first bubble needs it
+        from PyQt6.QtWebEngineWidgets import QWebEngineView
+        one_row_height = self._one_row_height
+        webview = QWebEngineView()
+        webview.setHtml(html)
+        webview.setMaximumWidth(480)
+        webview.setMinimumHeight(one_row_height)
+        webview.setMaximumHeight(one_row_height)
+        webview.setFixedHeight(one_row_height)
+        webview.setSizePolicy(QtWidgets.QSizePolicy.Policy.Preferred, QtWidgets.QSizePolicy.Policy.Minimum)
+        webview.setStyleSheet("background: transparent; border: none;")
+        webview.page().setBackgroundColor(QtGui.QColor(web_bg))
+        bubble_layout.addWidget(webview)
+        self._webview = webview
+
+        # Adjust height after content loads; a layout manager (request_height)
+        # batches the probe together with the other bubbles of the view
+        if request_height:
+            webview.loadFinished.connect(lambda _: request_height(self))
+        else:
+            webview.loadFinished.connect(lambda _: self.measure_height(on_height_ready))
+
+    def _submit_render(self, lazy_code):
+        def done(future):
+            try:
+                body, deferred = future.result()
+                self.html_ready_signal.emit(body, deferred)
+            except RuntimeError:
+                pass  # Bubble was deleted before rendering finished
+            except Exception as e:
+                print(f"Error rendering markdown: {e}")
+        markdown_renderer.submit(self._message, lazy_code).add_done_callback(done)
+
+    def _swap_html(self, body, deferred):
+        self._webview.setHtml(f"<!DOCTYPE html><html><head>{self._css}</head><body>{body}</body></html>")
+        if not self._use_webengine and self._request_height:
+            self._request_height(self)  # No loadFinished for QTextBrowser
+        if deferred:
+            # Huge code blocks were left plain; highlight them in a second pass
+            self._submit_render(lazy_code=False)
+
+    def measure_height(self, done=None):
+        """Probe the rendered page height and size the web view to fit it."""
+        webview = self._webview
+        one_row_height = self._one_row_height
+        if not self._use_webengine:
+            # The document size is already known; documentSizeChanged keeps it current
+            webview.setFixedHeight(max(one_row_height, int(webview.document().size().height()) + 8))
+            if done:
+                done()
+            return
+
+        def set_height(h):
+            webview.setMinimumHeight(one_row_height)
+            webview.setMaximumHeight(16777215)
+            webview.setFixedHeight(int(h) + 8 if h and int(h) > 0 else one_row_height)
+            if done:
+                done()
+
+        webview.page().runJavaScript(
+            """
+            (function() {
+                var body = document.body, html = document.documentElement;
+                return Math.max(
+                    body.scrollHeight, body.offsetHeight,
+                    html.clientHeight, html.scrollHeight, html.offsetHeight
+                );
+            })();
+            """,
+            set_height
+        )
+
+class PromptEdit(QtWidgets.QTextEdit):
+    """Prompt editor that hands very large pastes and dropped/pasted images off as attachments."""
+    large_paste_signal = QtCore.pyqtSignal(str)
+    image_signal = QtCore.pyqtSignal(str, object)  # name, file path or image bytes
+
+    def _image_paths(self, source):
+        if not source.hasUrls():
+            return []
+        return [u.toLocalFile() for u in source.urls() if u.isLocalFile() and is_image_path(u.toLocalFile())]
+
+    def canInsertFromMimeData(self, source):
+        return source.hasImage() or bool(self._image_paths(source)) or super().canInsertFromMimeData(source)
+
+    def insertFromMimeData(self, source):
+        paths = self._image_paths(source)
+        if paths:
+            for path in paths:
+                self.image_signal.emit(os.path.basename(path), path)
+            return
+        if source.hasImage():
+            # Clipboard images have no file; hand over PNG bytes
+            buffer = QtCore.QBuffer()
+            buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
+            QtGui.QImage(source.imageData()).save(buffer, "PNG")
+            self.image_signal.emit("pasted image.png", bytes(buffer.data()))
+            return
+        if source.hasText() and len(source.text()) > LARGE_PASTE_CHARS:
+            self.large_paste_signal.emit(source.text())
+            return
+        super().insertFromMimeData(source)
+
+class ChatHistoryListModel(QtCore.QAbstractListModel):
+    """List model over the shared chat_histories list.
+
+    Mutations go through append_chat/remove_chat/chat_changed so the view
+    receives incremental insert/remove/dataChanged notifications instead of
+    rebuilding every row.
+    """
+
+    def __init__(self, histories, parent=None):
+        super().__init__(parent)
+        self._histories = histories
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._histories)
+
+    def data(self, index, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._histories):
+            return None
+        hist = self._histories[index.row()]
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            return hist.get("title", "")
+        if role == QtCore.Qt.ItemDataRole.UserRole:
+            return hist
+        return None
+
+    def set_histories(self, histories):
+        self.beginResetModel()
+        self._histories = histories
+        self.endResetModel()
+
+    def append_chat(self, hist):
+        row = len(self._histories)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._histories.append(hist)
+        self.endInsertRows()
+        return row
+
+    def remove_chat(self, row):
+        if row < 0 or row >= len(self._histories):
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self._histories[row]
+        self.endRemoveRows()
+
+    def chat_changed(self, row):
+        if row is None or row < 0 or row >= len(self._histories):
+            return
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [QtCore.Qt.ItemDataRole.DisplayRole])
+
+class ChatHistoryItemDelegate(QtWidgets.QStyledItemDelegate):
+    """Paints a trash icon and the chat title for a single (visible) row."""
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.setMouseTracking(True)
         self._icon_size = 18
         self._icon_padding = 10
         self._text_padding = 14
-        self._vertical_padding = 27  # 18 * 1.5 = 27, increase by 50%
         self._trash_icon = QtGui.QIcon.fromTheme("edit-delete")
         if self._trash_icon.isNull():
-            # Fallback to emoji if no icon found
-            self._trash_pixmap = QtGui.QPixmap(18, 18)
+            # Fallback to an empty pixmap if no icon found
+            self._trash_pixmap = QtGui.QPixmap(self._icon_size, self._icon_size)
             self._trash_pixmap.fill(QtCore.Qt.GlobalColor.transparent)
-            painter = QtGui.QPainter(self._trash_pixmap)
-            painter.end()
         else:
             self._trash_pixmap = self._trash_icon.pixmap(self._icon_size, self._icon_size)
 
-    def paintEvent(self, event):
-        super().paintEvent(event)
-        painter = QtGui.QPainter(self.viewport())
-        for i in range(self.count()):
-            rect = self.visualItemRect(self.item(i))
-            # Add vertical padding (now increased by 50%)
-            padded_rect = rect.adjusted(0, self._vertical_padding, 0, -self._vertical_padding)
-            # Draw trash icon
-            icon_rect = QtCore.QRect(
-                padded_rect.left() + self._icon_padding,
-                padded_rect.center().y() - self._icon_size // 2,
-                self._icon_size,
-                self._icon_size
-            )
-            painter.drawPixmap(icon_rect, self._trash_pixmap)
-            # Draw label to the right of the icon
-            text_rect = QtCore.QRect(
-                icon_rect.right() + self._text_padding,
-                padded_rect.top(),
-                padded_rect.width() - (icon_rect.width() + self._icon_padding + self._text_padding),
-                padded_rect.height()
-            )
-            hist = self.item(i).data(QtCore.Qt.ItemDataRole.UserRole)
-            label = hist["title"] if hist and "title" in hist else self.item(i).text()
-            painter.setPen(self.palette().color(QtGui.QPalette.ColorRole.Text))
-            painter.drawText(text_rect, int(QtCore.Qt.AlignmentFlag.AlignVCenter | QtCore.Qt.AlignmentFlag.AlignLeft), label)
-        painter.end()
+    def icon_rect(self, rect):
+        return QtCore.QRect(
+            rect.left() + self._icon_padding,
+            rect.center().y() - self._icon_size // 2,
+            self._icon_size,
+            self._icon_size
+        )
+
+    def sizeHint(self, option, index):
+        # 2.5x the font height gives the "tall" rows the list always had
+        return QtCore.QSize(220, int(option.fontMetrics.height() * 2.5))
+
+    def paint(self, painter, option, index):
+        opt = QtWidgets.QStyleOptionViewItem(option)
+        self.initStyleOption(opt, index)
+        opt.text = ""  # Background/selection only; the label is drawn below
+        style = opt.widget.style() if opt.widget else QtWidgets.QApplication.style()
+        style.drawControl(QtWidgets.QStyle.ControlElement.CE_ItemViewItem, opt, painter, opt.widget)
+
+        painter.save()
+        icon_rect = self.icon_rect(option.rect)
+        painter.drawPixmap(icon_rect, self._trash_pixmap)
+        text_rect = QtCore.QRect(
+            icon_rect.right() + self._text_padding,
+            option.rect.top(),
+            option.rect.right() - icon_rect.right() - self._text_padding,
+            option.rect.height()
+        )
+        label = index.data(QtCore.Qt.ItemDataRole.DisplayRole) or ""
+        label = option.fontMetrics.elidedText(label, QtCore.Qt.TextElideMode.ElideRight, text_rect.width())
+        painter.setPen(option.palette.color(QtGui.QPalette.ColorRole.Text))
+        painter.drawText(text_rect, int(QtCore.Qt.AlignmentFlag.AlignVCenter | QtCore.Qt.AlignmentFlag.AlignLeft), label)
+        painter.restore()
+
+class ChatHistoryListWidget(QtWidgets.QListView):
+    """Chat list view with a trash icon per row, painted by ChatHistoryItemDelegate."""
+    delete_chat_signal = QtCore.pyqtSignal(int)
+    current_row_changed = QtCore.pyqtSignal(int)
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setMouseTracking(True)
+        self.setUniformItemSizes(True)  # Rows are all the same height: O(1) layout
+        # Extended selection so several chats can be exported at once
+        self.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.ExtendedSelection)
+        self._delegate = ChatHistoryItemDelegate(self)
+        self.setItemDelegate(self._delegate)
+        self.setModel(model)
+        self.selectionModel().currentRowChanged.connect(
+            lambda current, previous: self.current_row_changed.emit(current.row())
+        )
+
+    def currentRow(self):
+        return self.currentIndex().row()
+
+    def selectedRows(self):
+        return sorted({index.row() for index in self.selectedIndexes()})
 
-    def sizeHintForRow(self, row):
-        # Increase row height for extra padding (now increased by 50%)
-        base = super().sizeHintForRow(row)
-        return base + 2 * self._vertical_padding
+    def setCurrentRow(self, row):
+        self.setCurrentIndex(self.model().index(row, 0))
 
     def mousePressEvent(self, event):
-        for i in range(self.count()):
-            rect = self.visualItemRect(self.item(i))
-            icon_rect = QtCore.QRect(
-                rect.left() + self._icon_padding,
-                rect.center().y() - self._icon_size // 2,
-                self._icon_size,
-                self._icon_size
-            )
-            if icon_rect.contains(event.pos()):
-                self.delete_chat_signal.emit(i)
-                return  # Don't select the item if trash is clicked
+        index = self.indexAt(event.pos())
+        if index.isValid() and self._delegate.icon_rect(self.visualRect(index)).contains(event.pos()):
+            self.delete_chat_signal.emit(index.row())
+            return  # Don't select the item if trash is clicked
         super().mousePressEvent(event)
 
 class ChatVBoxLayout(QtWidgets.QVBoxLayout):
-    """A QVBoxLayout that always scrolls its parent QScrollArea to the bottom when a widget is added."""
+    """
+    A QVBoxLayout that keeps its parent QScrollArea scrolled to the bottom.
+
+    Bubble height probes are queued and flushed together once per frame, and
+    scroll requests are coalesced into a single scroll per frame. Nothing here
+    re-enters the event loop: the deferred timers let Qt process the pending
+    layout requests before the scrollbar range is read.
+    """
+    FRAME_MS = 16
+
     def __init__(self, parent_widget, scroll_area):
         super().__init__(parent_widget)
         self._scroll_area = scroll_area
+        self._scroll_anim = None
+        self._pending_heights = []
+        self._outstanding_heights = 0
+        self._awaiting_load = 0
+        self._loading = False
+        self._measure_timer = QtCore.QTimer()
+        self._measure_timer.setSingleShot(True)
+        self._measure_timer.setInterval(self.FRAME_MS)
+        self._measure_timer.timeout.connect(self._flush_heights)
+        self._scroll_timer = QtCore.QTimer()
+        self._scroll_timer.setSingleShot(True)
+        self._scroll_timer.setInterval(self.FRAME_MS)
+        self._scroll_timer.timeout.connect(self._do_scroll)
+        # Per chat load counters
+        self.bubble_count = 0
+        self.layout_count = 0
+        self.scroll_count = 0
 
     def addWidget(self, widget, stretch=0, alignment=QtCore.Qt.AlignmentFlag(0)):
+        if isinstance(widget, ChatBubble):
+            self.bubble_count += 1
+            self._awaiting_load += 1
         super().addWidget(widget, stretch, alignment)
 
     def insertWidget(self, index, widget, stretch=0, alignment=QtCore.Qt.AlignmentFlag(0)):
         super().insertWidget(index, widget, stretch, alignment)
 
+    def begin_chat_load(self):
+        """Drop queued work for the old chat and start counting for a new one."""
+        self._pending_heights = []
+        self._outstanding_heights = 0
+        self._awaiting_load = 0
+        self._loading = True
+        self.bubble_count = 0
+        self.layout_count = 0
+        self.scroll_count = 0
+        self.scroll_to_bottom()
+
+    def request_height(self, bubble):
+        """Queue a bubble whose page has loaded for the next batched height probe."""
+        # Async bubbles load again when their rendered HTML is swapped in; only the first load counts
+        if not bubble._load_reported:
+            bubble._load_reported = True
+            self._awaiting_load = max(0, self._awaiting_load - 1)
+        self._pending_heights.append(bubble)
+        if not self._measure_timer.isActive():
+            self._measure_timer.start()
+
+    def _flush_heights(self):
+        batch, self._pending_heights = self._pending_heights, []
+        if not batch:
+            return
+        self.layout_count += 1
+        for bubble in batch:
+            try:
+                bubble.measure_height(self._on_height_measured)
+                self._outstanding_heights += 1
+            except RuntimeError:
+                pass  # Bubble was deleted (chat switched) before it was measured
+
+    def _on_height_measured(self):
+        self._outstanding_heights = max(0, self._outstanding_heights - 1)
+        if not self._outstanding_heights:
+            self.scroll_to_bottom()
+
     def scroll_to_bottom(self):
-        if self._scroll_area and self._scroll_area.widget():
-            self._scroll_area.widget().adjustSize()
-            QtCore.QCoreApplication.processEvents()
-            scrollbar = self._scroll_area.verticalScrollBar()
-            end_value = scrollbar.maximum()
-            # Animate only if not already at the bottom
-            if scrollbar.value() != end_value:
-                anim = QtCore.QPropertyAnimation(scrollbar, b"value")
-                anim.setDuration(400)
-                anim.setStartValue(scrollbar.value())
-                anim.setEndValue(end_value)
-                anim.setEasingCurve(QtCore.QEasingCurve.Type.InOutQuad)
-                # Keep a reference to prevent garbage collection
-                self._scroll_anim = anim
-                anim.start()
-            else:
-                scrollbar.setValue(end_value)
+        if not self._scroll_timer.isActive():
+            self._scroll_timer.start()
+
+    def _do_scroll(self):
+        if not (self._scroll_area and self._scroll_area.widget()):
+            return
+        self.scroll_count += 1
+        scrollbar = self._scroll_area.verticalScrollBar()
+        end_value = scrollbar.maximum()
+        # Animate only single additions, and only if not already at the bottom
+        if not self._loading and scrollbar.value() != end_value:
+            if self._scroll_anim:
+                self._scroll_anim.stop()
+            anim = QtCore.QPropertyAnimation(scrollbar, b"value")
+            anim.setDuration(400)
+            anim.setStartValue(scrollbar.value())
+            anim.setEndValue(end_value)
+            anim.setEasingCurve(QtCore.QEasingCurve.Type.InOutQuad)
+            # Keep a reference to prevent garbage collection
+            self._scroll_anim = anim
+            anim.start()
+        else:
+            scrollbar.setValue(end_value)
+        if self._loading and not (self._awaiting_load or self._pending_heights or self._outstanding_heights):
+            self._loading = False
+            diagnostics.record_chat_load(self.bubble_count, self.layout_count, self.scroll_count)
 
 # --- Add to config section ---
 DEFAULT_PROFILES = [
@@ -392,14 +891,180 @@ def set_selected_profile_idx(idx):
     config["selected_profile_idx"] = idx
     save_config(config)
 
+class CompareDialog(QtWidgets.QDialog):
+    """Sends one prompt to several models at once and streams the replies side by side."""
+    chunk_signal = QtCore.pyqtSignal(int, int, str)  # run, column, text
+    stats_signal = QtCore.pyqtSignal(int, int, str)  # run, column, stats line
+
+    def __init__(self, models, prefix, max_concurrent, on_select_model=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Compare Models")
+        self.resize(1100, 650)
+        self.setAttribute(QtCore.Qt.WidgetAttribute.WA_DeleteOnClose)
+        self._prefix = prefix
+        self._max_concurrent = max_concurrent
+        self._on_select_model = on_select_model
+        self._cancelled = threading.Event()
+        self._columns = []
+        self._run = 0  # Output tagged with an older run is dropped
+
+        layout = QtWidgets.QVBoxLayout(self)
+        top = QtWidgets.QHBoxLayout()
+        self._model_list = QtWidgets.QListWidget()
+        self._model_list.setMaximumWidth(220)
+        for name in models:
+            item = QtWidgets.QListWidgetItem(name)
+            item.setFlags(item.flags() | QtCore.Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.CheckState.Unchecked)
+            self._model_list.addItem(item)
+        top.addWidget(self._model_list)
+        self._prompt = QtWidgets.QTextEdit()
+        self._prompt.setPlaceholderText("Prompt to send to every checked model")
+        top.addWidget(self._prompt, 1)
+        run_btn = QtWidgets.QPushButton("Run")
+        run_btn.clicked.connect(self.run_comparison)
+        top.addWidget(run_btn, 0, QtCore.Qt.AlignmentFlag.AlignBottom)
+        layout.addLayout(top, 1)
+
+        self._columns_splitter = QtWidgets.QSplitter(QtCore.Qt.Orientation.Horizontal)
+        layout.addWidget(self._columns_splitter, 3)
+
+        self.chunk_signal.connect(self._append_chunk)
+        self.stats_signal.connect(self._set_stats)
+
+    def run_comparison(self):
+        prompt = self._prompt.toPlainText().strip()
+        models = [
+            self._model_list.item(i).text() for i in range(self._model_list.count())
+            if self._model_list.item(i).checkState() == QtCore.Qt.CheckState.Checked
+        ]
+        if not prompt or not models:
+            return
+        # Stop any previous run and start fresh columns
+        self._cancelled.set()
+        self._cancelled = threading.Event()
+        self._run += 1
+        for column in self._columns:
+            column["widget"].deleteLater()
+        self._columns = []
+        for model in models:
+            self._columns.append(self._make_column(model))
+
+        messages = [
+            {"role": "system", "content": self._prefix},
+            {"role": "user", "content": prompt},
+        ]
+        limiter = get_host_limiter(OLLAMA_HOST, self._max_concurrent)
+        for i, model in enumerate(models):
+            threading.Thread(
+                target=self._stream_model, args=(self._run, i, model, messages, limiter, self._cancelled), daemon=True
+            ).start()
+
+    def _make_column(self, model):
+        widget = QtWidgets.QWidget()
+        col_layout = QtWidgets.QVBoxLayout(widget)
+        col_layout.setContentsMargins(4, 4, 4, 4)
+        header = QtWidgets.QHBoxLayout()
+        title = QtWidgets.QLabel(f"<b>{model}</b>")
+        header.addWidget(title, 1)
+        if self._on_select_model:
+            use_btn = QtWidgets.QPushButton("Use")
+            use_btn.setToolTip("Make this the chat model")
+            use_btn.clicked.connect(lambda _=False, m=model: self._on_select_model(m))
+            header.addWidget(use_btn)
+        col_layout.addLayout(header)
+        text = QtWidgets.QPlainTextEdit()
+        text.setReadOnly(True)
+        col_layout.addWidget(text, 1)
+        stats = QtWidgets.QLabel("Waiting...")
+        stats.setWordWrap(True)
+        col_layout.addWidget(stats)
+        self._columns_splitter.addWidget(widget)
+        return {"widget": widget, "text": text, "stats": stats}
+
+    def _stream_model(self, run, column, model, messages, limiter, cancelled):
+        def emit(signal, value):
+            if cancelled.is_set():
+                return
+            try:
+                signal.emit(run, column, value)
+            except RuntimeError:
+                cancelled.set()  # Dialog was closed and deleted
+
+        with limiter:
+            if cancelled.is_set():
+                return
+            emit(self.stats_signal, "Running...")
+            start = time.perf_counter()
+            first_token = None
+            final = None
+            try:
+                # The limiter is already held here, so bypass the client's own
+                for chunk in get_ollama_client().unlimited.chat(model=model, messages=messages, stream=True):
+                    if cancelled.is_set():
+                        return
+                    content = chunk.get("message", {}).get("content", "")
+                    if content:
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        emit(self.chunk_signal, content)
+                    if chunk.get("done"):
+                        final = chunk
+            except Exception as e:
+                emit(self.stats_signal, f"Error: {e}")
+                return
+            total = time.perf_counter() - start
+        emit(self.stats_signal, format_generation_stats(final, first_token, total))
+
+    def _append_chunk(self, run, column, text):
+        if run == self._run and column < len(self._columns):
+            edit = self._columns[column]["text"]
+            cursor = edit.textCursor()
+            cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
+            cursor.insertText(text)
+
+    def _set_stats(self, run, column, text):
+        if run == self._run and column < len(self._columns):
+            self._columns[column]["stats"].setText(text)
+
+    def closeEvent(self, event):
+        self._cancelled.set()
+        super().closeEvent(event)
+
+def format_generation_stats(final, first_token, total):
+    """One-line latency/throughput summary from the final streamed chunk."""
+    parts = []
+    if first_token is not None:
+        parts.append(f"first token {first_token * 1000:.0f} ms")
+    parts.append(f"total {total:.2f} s")
+    if final:
+        prompt_tokens = final.get("prompt_eval_count") or 0
+        eval_count = final.get("eval_count") or 0
+        eval_duration = final.get("eval_duration") or 0
+        if eval_count and eval_duration:
+            parts.append(f"{eval_count / (eval_duration / 1e9):.1f} tok/s")
+        parts.append(f"{prompt_tokens} prompt + {eval_count} completion tokens")
+    return " | ".join(parts)
+
 class MainWindow(QtWidgets.QMainWindow):
-    update_chat_signal = QtCore.pyqtSignal(str, object, object)  # reply, think_content, last_json
+    update_chat_signal = QtCore.pyqtSignal(object, object, object)  # assistant Message, its chat, parent index
     scroll_to_bottom_signal = QtCore.pyqtSignal()
     update_thinking_label_signal = QtCore.pyqtSignal(str)  # <-- Already present
-
-    def __init__(self):
+    archive_progress_signal = QtCore.pyqtSignal(int)  # per mille
+    archive_chat_signal = QtCore.pyqtSignal(object)  # imported chat dict
+    archive_done_signal = QtCore.pyqtSignal(str)  # result message
+    model_metadata_signal = QtCore.pyqtSignal()  # background metadata refresh changed the cache
+    models_loaded_signal = QtCore.pyqtSignal(object)  # list from fetch_models()
+    attachment_ready_signal = QtCore.pyqtSignal(object)  # ingested attachment record
+    attachment_status_signal = QtCore.pyqtSignal(str)
+    knowledge_status_signal = QtCore.pyqtSignal(str)
+    window_shown_signal = QtCore.pyqtSignal(float)  # perf_counter() when the window was first shown
+
+    def __init__(self, stall_threshold_ms=None):
         super().__init__()
         self.config = load_config()
+        # Every Ollama call (chat, compare, metadata, embeddings) shares this per-host limit
+        get_host_limiter(OLLAMA_HOST, self.config.get("max_concurrent_per_host", DEFAULT_MAX_CONCURRENT_PER_HOST))
         self.profiles = load_profiles()
         self.selected_profile_idx = get_selected_profile_idx()
         global system_prefix
@@ -428,13 +1093,18 @@ class MainWindow(QtWidgets.QMainWindow):
         model_label = QtWidgets.QLabel("Model")
         left_panel.addWidget(model_label)
         self.model_combo = QtWidgets.QComboBox()
-        self.model_combo.addItems(model_names)
-        initial_model = self.config.get("selected_model")
-        if initial_model and initial_model in model_names:
-            self.model_combo.setCurrentText(initial_model)
+        self.model_combo.setPlaceholderText("Loading models...")
         self.model_combo.currentTextChanged.connect(self.save_model)
         left_panel.addWidget(self.model_combo)
 
+        # Model capabilities/context length, refreshed in the background when digests change
+        self.model_registry = ModelRegistry(get_ollama_client, self.config.get("model_metadata"))
+        self.model_metadata_signal.connect(self.on_model_metadata_changed)
+
+        # The model list comes from the server; fetch it without holding up the window
+        self.models_loaded_signal.connect(self.on_models_loaded)
+        threading.Thread(target=lambda: self.models_loaded_signal.emit(fetch_models()), daemon=True).start()
+
         # Add spacing between Model and Profiles
         left_panel.addSpacing(10)  # <-- Add a little vertical padding
 
@@ -469,8 +1139,9 @@ class MainWindow(QtWidgets.QMainWindow):
         left_panel.addSpacing(16)  # <-- Add vertical padding here
 
         # Chat history panel
-        self.chat_history_list = ChatHistoryListWidget()
-        self.chat_history_list.itemSelectionChanged.connect(self.on_chat_history_select)
+        self.chat_history_model = ChatHistoryListModel(self.chat_histories)
+        self.chat_history_list = ChatHistoryListWidget(self.chat_history_model)
+        self.chat_history_list.current_row_changed.connect(self.on_chat_history_select)
         self.chat_history_list.delete_chat_signal.connect(self.delete_chat_by_index)
         # --- Change "+ New Chat" button to icon-only, right of "Chats" label ---
         chat_label = QtWidgets.QLabel("Chats")
@@ -531,8 +1202,10 @@ class MainWindow(QtWidgets.QMainWindow):
         user_icon_label.setFont(QtGui.QFont("Segoe UI Emoji", 14))
         user_icon_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignTop)
 
-        self.command_prompt = QtWidgets.QTextEdit()
+        self.command_prompt = PromptEdit()
         self.command_prompt.setFixedHeight(60)
+        self.command_prompt.large_paste_signal.connect(self.attach_pasted_text)
+        self.command_prompt.image_signal.connect(self.attach_image)
         self.command_prompt.installEventFilter(self)
         # Style to match user chat bubble
         self.command_prompt.setStyleSheet("""
@@ -549,10 +1222,28 @@ class MainWindow(QtWidgets.QMainWindow):
             }
         """)
 
+        attach_btn = QtWidgets.QPushButton("📎")
+        attach_btn.setFixedSize(28, 28)
+        attach_btn.setToolTip("Attach a file or image (images can also be dropped or pasted)")
+        attach_btn.clicked.connect(self.choose_attachment)
+
         prompt_layout.addStretch(1)
+        prompt_layout.addWidget(attach_btn, 0, QtCore.Qt.AlignmentFlag.AlignTop)
         prompt_layout.addWidget(self.command_prompt, 6)  # 6/8 = 75%
         prompt_layout.addWidget(user_icon_label, 1)      # 1/8 = 12.5%
 
+        # Pending attachments for the next message
+        self.pending_attachments = []
+        self.pending_edit = None  # (chat, position) of a prompt being edited; forked only when sent
+        self.attachment_label = QtWidgets.QLabel()
+        self.attachment_label.setStyleSheet("color: #555; padding: 0px 8px;")
+        self.attachment_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight)
+        self.attachment_label.linkActivated.connect(lambda _: self.clear_attachments())
+        self.attachment_label.setVisible(False)
+        prompt_area_layout.addWidget(self.attachment_label, 0)
+        self.attachment_ready_signal.connect(self.on_attachment_ready)
+        self.attachment_status_signal.connect(self.show_attachment_status)
+
         prompt_area_layout.addWidget(self.prompt_container, 0)
 
         right_splitter.addWidget(prompt_area)
@@ -560,11 +1251,341 @@ class MainWindow(QtWidgets.QMainWindow):
         # Now install event filter for chat_history_list (after command_prompt is created)
         self.chat_history_list.installEventFilter(self)
 
-        self.add_new_chat_if_needed()
+        # The first chat is loaded from showEvent, so bubbles don't delay the window
+        self._shown = False
+
+        # Profile knowledge bases: indexed in the background, after startup and then periodically
+        self._knowledge_bases = {}
+        self.knowledge_status_signal.connect(self.on_knowledge_status)
+        self._knowledge_timer = QtCore.QTimer(self)
+        self._knowledge_timer.setInterval(KNOWLEDGE_RESCAN_MS)
+        self._knowledge_timer.timeout.connect(self.update_knowledge_base)
+        self._knowledge_timer.start()
+        QtCore.QTimer.singleShot(2000, self.update_knowledge_base)
+
         self.update_chat_signal.connect(self.update_chat)
         self.scroll_to_bottom_signal.connect(self.chat_area_layout.scroll_to_bottom)
         self.update_thinking_label_signal.connect(self.update_thinking_label)  # <-- Already present
 
+        # File menu: streaming export/import of chat archives
+        self._archive_progress = None
+        self._archive_imported = False
+        file_menu = self.menuBar().addMenu("&File")
+        export_action = file_menu.addAction("Export Selected Chats...")
+        export_action.triggered.connect(self.export_chats)
+        import_action = file_menu.addAction("Import Chats...")
+        import_action.triggered.connect(self.import_chats)
+        tools_menu = self.menuBar().addMenu("&Tools")
+        compare_action = tools_menu.addAction("Compare Models...")
+        compare_action.triggered.connect(self.open_compare_dialog)
+        self.archive_progress_signal.connect(self.on_archive_progress)
+        self.archive_chat_signal.connect(self.on_archive_chat)
+        self.archive_done_signal.connect(self.on_archive_done)
+
+        # Event-loop stall watchdog: a GUI timer beats, a background thread watches
+        if stall_threshold_ms is None:
+            stall_threshold_ms = self.config.get("stall_threshold_ms", DEFAULT_STALL_THRESHOLD_MS)
+        self._stall_watchdog = None
+        if stall_threshold_ms > 0:
+            self._stall_watchdog = diagnostics.start_stall_watchdog(stall_threshold_ms)
+            self._heartbeat_timer = QtCore.QTimer(self)
+            self._heartbeat_timer.setInterval(100)
+            self._heartbeat_timer.timeout.connect(self._stall_watchdog.heartbeat)
+            self._heartbeat_timer.start()
+
+        # Debug panel (profiling / memory diagnostics)
+        self._debug_panel = None
+        QtGui.QShortcut(QtGui.QKeySequence("Ctrl+Shift+D"), self, self.open_debug_panel)
+
+    def open_debug_panel(self):
+        if self._debug_panel:
+            self._debug_panel.raise_()
+            self._debug_panel.activateWindow()
+            return
+        dlg = QtWidgets.QDialog(self)
+        dlg.setWindowTitle("Diagnostics")
+        dlg.resize(700, 500)
+        dlg.setAttribute(QtCore.Qt.WidgetAttribute.WA_DeleteOnClose)
+        layout = QtWidgets.QVBoxLayout(dlg)
+
+        profile_check = QtWidgets.QCheckBox("Profile queries, chat switches and saves")
+        profile_check.setChecked(diagnostics.profiling_enabled())
+        profile_check.toggled.connect(diagnostics.set_profiling)
+        layout.addWidget(profile_check)
+
+        output = QtWidgets.QPlainTextEdit()
+        output.setReadOnly(True)
+        output.setFont(QtGui.QFont("Consolas", 9))
+
+        def show(text):
+            output.setPlainText(text)
+
+        def dump_profiles():
+            paths = diagnostics.dump_profiles()
+            show("Wrote:\n" + "\n".join(paths))
+
+        def dump_snapshot():
+            path = diagnostics.dump_snapshot()
+            show(f"Wrote: {path}" if path else "No snapshot taken yet.")
+
+        buttons = [
+            ("Profile summary", lambda: show(diagnostics.profile_summary())),
+            ("Reset profiles", lambda: (diagnostics.reset_profiles(), show("Profiles reset."))),
+            ("Dump profiles", dump_profiles),
+            ("Take snapshot", lambda: show(diagnostics.take_snapshot())),
+            ("Diff snapshots", lambda: show(diagnostics.diff_snapshots())),
+            ("Dump snapshot", dump_snapshot),
+            ("Count instances", lambda: show(diagnostics.instance_report())),
+            ("Stall report", lambda: show(diagnostics.stall_report())),
+            ("Chat loads", lambda: show(diagnostics.chat_load_report())),
+            ("Knowledge bases", lambda: show(
+                "\n".join(kb.describe() for kb in self._knowledge_bases.values()) or "No knowledge bases loaded."
+            )),
+        ]
+        grid = QtWidgets.QGridLayout()
+        for i, (label, handler) in enumerate(buttons):
+            btn = QtWidgets.QPushButton(label)
+            btn.clicked.connect(handler)
+            grid.addWidget(btn, i // 4, i % 4)
+        layout.addLayout(grid)
+        layout.addWidget(output, 1)
+
+        def on_destroyed():
+            self._debug_panel = None
+        dlg.destroyed.connect(on_destroyed)
+        self._debug_panel = dlg
+        dlg.show()
+
+    def open_compare_dialog(self):
+        dlg = CompareDialog(
+            model_names,
+            self.profiles[self.selected_profile_idx]["prefix"],
+            self.config.get("max_concurrent_per_host", DEFAULT_MAX_CONCURRENT_PER_HOST),
+            on_select_model=self.model_combo.setCurrentText,
+            parent=self,
+        )
+        dlg.show()
+
+    def export_chats(self):
+        rows = self.chat_history_list.selectedRows() or [self.chat_history_list.currentRow()]
+        chats = [self.chat_histories[r] for r in rows if 0 <= r < len(self.chat_histories)]
+        if not chats:
+            return
+        path, selected_filter = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Export Chats", "chats.jsonl", "JSON Lines (*.jsonl);;Markdown (*.md)"
+        )
+        if not path:
+            return
+        markdown_export = path.lower().endswith(".md") or selected_filter.startswith("Markdown")
+        export = export_markdown if markdown_export else export_jsonl
+
+        def task(progress):
+            export(chats, path, progress)
+            return f"Exported {len(chats)} chat(s) to {path}"
+        self.run_archive_task("Exporting chats...", task)
+
+    def import_chats(self):
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, "Import Chats", "", "Chat archives (*.jsonl *.json);;All files (*)"
+        )
+        if not path:
+            return
+
+        def task(progress):
+            count = 0
+            for chat in iter_archive(path, progress):
+                self.archive_chat_signal.emit(chat)
+                count += 1
+            return f"Imported {count} chat(s) from {path}"
+        self.run_archive_task("Importing chats...", task)
+
+    def run_archive_task(self, label, task):
+        """Runs an export/import task on a worker thread with a progress dialog."""
+        if self._archive_progress:
+            return
+        dlg = QtWidgets.QProgressDialog(label, None, 0, 1000, self)
+        dlg.setWindowTitle("Chats")
+        dlg.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
+        dlg.setMinimumDuration(300)
+        dlg.setValue(0)
+        self._archive_progress = dlg
+        self._archive_imported = False
+
+        def run():
+            last = [-1]
+
+            def progress(done, total):
+                permille = int(done * 1000 / total) if total else 1000
+                if permille != last[0]:  # Only signal the GUI when the bar moves
+                    last[0] = permille
+                    self.archive_progress_signal.emit(permille)
+            try:
+                message = task(progress)
+            except Exception as e:
+                message = f"Error: {e}"
+            self.archive_done_signal.emit(message)
+        threading.Thread(target=run, daemon=True).start()
+
+    def on_archive_progress(self, permille):
+        if self._archive_progress:
+            self._archive_progress.setValue(permille)
+
+    def on_archive_chat(self, chat):
+        self.chat_history_model.append_chat(init_chat_tree(chat))
+        self._archive_imported = True
+
+    def on_archive_done(self, message):
+        if self._archive_progress:
+            self._archive_progress.close()
+            self._archive_progress.deleteLater()
+            self._archive_progress = None
+        if self._archive_imported:
+            save_chat_histories(self.chat_histories)
+        QtWidgets.QMessageBox.information(self, "Chats", message)
+
+    def choose_attachment(self):
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, "Attach File", "",
+            "Text files (*.txt *.log *.md *.csv *.json *.py);;Images (*.png *.jpg *.jpeg *.gif *.bmp *.webp);;All files (*)"
+        )
+        if path and is_image_path(path):
+            self.attach_image(os.path.basename(path), path)
+        elif path:
+            self.attach_file(path)
+
+    def attach_pasted_text(self, text):
+        self.attach_file(None, text)
+
+    def attach_file(self, path, pasted_text=None):
+        """Ingests a file (or a large paste) on a worker thread; the record arrives via attachment_ready_signal."""
+        model = self.model_combo.currentText() or selected_model
+        num_ctx = self.request_num_ctx(model) or 4096
+        # Everything else the next request will carry; attachments are re-sent with every later turn
+        history = tuple(self.chat_history)
+        pending = list(self.pending_attachments)
+        profile = self.profiles[self.selected_profile_idx]
+        knowledge_tokens = profile.get("knowledge_tokens", DEFAULT_TOKEN_BUDGET) if self.knowledge_base(profile) else 0
+        self.show_attachment_status("📎 Reading attachment...")
+
+        def run():
+            try:
+                used = (
+                    estimate_tokens(profile["prefix"]) + knowledge_tokens
+                    + sum(estimate_tokens(message_content(m)) for m in history)
+                    + sum(att.get("sent_tokens", 0) for att in pending)
+                )
+                token_budget = max(MIN_ATTACHMENT_TOKENS, num_ctx - int(num_ctx * REPLY_CONTEXT_SHARE) - used)
+                file_path = path or save_pasted_text(pasted_text)
+
+                def progress(done, total):
+                    self.attachment_status_signal.emit(f"📎 Reading {os.path.basename(file_path)}... {done * 100 // max(total, 1)}%")
+                try:
+                    att = ingest_file(file_path, token_budget, progress)
+                finally:
+                    if not path:
+                        # The excerpt is in the blob store now; the pasted text file was only a carrier
+                        try:
+                            os.remove(file_path)
+                        except OSError as e:
+                            print(f"Error removing {file_path}: {e}")
+            except Exception as e:
+                self.attachment_status_signal.emit(f"📎 Could not attach file: {e}")
+                return
+            self.attachment_ready_signal.emit(att)
+        threading.Thread(target=run, daemon=True).start()
+
+    def attach_image(self, name, source):
+        """Downscales and encodes an image on a worker thread; the record arrives via attachment_ready_signal."""
+        model = self.model_combo.currentText() or selected_model
+        max_side = self.model_registry.image_size(model) or DEFAULT_IMAGE_SIDE
+        if self.model_registry.supports_vision(model) is False:
+            self.show_attachment_status(f"🖼 {model} does not list vision support; the image may be ignored")
+        else:
+            self.show_attachment_status(f"🖼 Preparing {name}...")
+
+        def run():
+            try:
+                if isinstance(source, str):
+                    with open(source, "rb") as f:
+                        data = f.read()
+                else:
+                    data = source
+                att = prepare_image(data, name, max_side)
+            except Exception as e:
+                self.attachment_status_signal.emit(f"🖼 Could not attach image: {e}")
+                return
+            self.attachment_ready_signal.emit(att)
+        threading.Thread(target=run, daemon=True).start()
+
+    def on_attachment_ready(self, att):
+        self.pending_attachments.append(att)
+        self.show_attachment_status()
+
+    def show_attachment_status(self, status=None):
+        lines = [attachment_summary(att) for att in self.pending_attachments]
+        if self.pending_edit:
+            lines.insert(0, "✎ Editing an earlier prompt; sending it starts a new branch")
+        if status:
+            lines.append(status)
+        if self.pending_attachments or self.pending_edit:
+            lines[-1] += ' <a href="clear">✕</a>'
+        self.attachment_label.setText("<br>".join(lines))
+        self.attachment_label.setVisible(bool(lines))
+
+    def clear_attachments(self):
+        self.pending_attachments = []
+        if self.pending_edit:
+            self.cancel_edit()
+        self.show_attachment_status()
+
+    def cancel_edit(self):
+        if self.pending_edit is None:
+            return
+        self.pending_edit = None
+        self.command_prompt.clear()
+        self.show_chat_history()
+        self.show_attachment_status()
+
+    def on_models_loaded(self, models):
+        global models_list, model_names, selected_model
+        models_list = models
+        model_names = [m.model for m in models]
+        selected_model = model_names[0] if model_names else None
+        # Filling the combo must not overwrite the saved choice via save_model
+        self.model_combo.blockSignals(True)
+        self.model_combo.addItems(model_names)
+        initial_model = self.config.get("selected_model")
+        if initial_model and initial_model in model_names:
+            self.model_combo.setCurrentText(initial_model)
+        self.model_combo.blockSignals(False)
+        self.update_model_tooltips()
+        self.model_registry.refresh_async(
+            models_list, lambda changed: self.model_metadata_signal.emit() if changed else None
+        )
+
+    def on_model_metadata_changed(self):
+        self.config["model_metadata"] = self.model_registry.to_config()
+        save_config(self.config)
+        self.update_model_tooltips()
+
+    def update_model_tooltips(self):
+        for i in range(self.model_combo.count()):
+            meta = self.model_registry.get(self.model_combo.itemText(i))
+            if not meta:
+                continue
+            parts = [p for p in (meta.get("parameter_size"), meta.get("quantization_level")) if p]
+            if meta.get("context_length"):
+                parts.append(f"ctx {meta['context_length']}")
+            parts.append(", ".join(meta.get("capabilities", [])))
+            self.model_combo.setItemData(i, " | ".join(parts), QtCore.Qt.ItemDataRole.ToolTipRole)
+
+    def request_num_ctx(self, model):
+        """num_ctx for a request: the configured limit, capped by the model's context length."""
+        context_length = self.model_registry.context_length(model)
+        if not context_length:
+            return None
+        return min(context_length, self.config.get("num_ctx_limit", DEFAULT_NUM_CTX_LIMIT))
+
     def save_model(self, text):
         self.config["selected_model"] = text
         save_config(self.config)
@@ -590,41 +1611,100 @@ class MainWindow(QtWidgets.QMainWindow):
         save_config(self.config)
         dlg.accept()
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self._shown:
+            self._shown = True
+            self.window_shown_signal.emit(time.perf_counter())
+            # Queued, so the window paints before the first chat's bubbles are built
+            QtCore.QTimer.singleShot(0, self.add_new_chat_if_needed)
+
     def add_new_chat_if_needed(self):
         # Helper to ensure at least one chat exists on startup
         if not self.chat_histories:
             self.add_new_chat()
         else:
             self.current_history_idx = 0
-            self.chat_history = list(self.chat_histories[0]["history"])
+            self.chat_history = self.chat_histories[0]["history"]
             self.refresh_chat_history_list()
-            self.chat_history_list.setCurrentRow(0)
-            self.clear_chat_area()
-            for msg in self.chat_history:
-                think_content = msg.get("think_content") if msg.get("role") == "assistant" else None
-                last_json = msg.get("last_json") if msg.get("role") == "assistant" else None
-                self.add_chat_bubble(msg["content"], msg["role"], think_content=think_content, last_json=last_json)
+            self.chat_history_list.setCurrentRow(0)  # Loads it through on_chat_history_select
 
     def add_new_chat(self):
-        self.chat_history = []
-        self.chat_histories.append({"title": "New chat", "history": []})
-        self.current_history_idx = len(self.chat_histories) - 1
-        self.refresh_chat_history_list()
+        chat = init_chat_tree({"title": "New chat", "history": []})
+        self.chat_history = chat["history"]
+        self.current_history_idx = self.chat_history_model.append_chat(chat)
         self.chat_history_list.setCurrentRow(self.current_history_idx)
         self.clear_chat_area()
         save_chat_histories(self.chat_histories)  # <-- Save after adding
 
-    def on_chat_history_select(self):
-        idx = self.chat_history_list.currentRow()
+    def on_chat_history_select(self, idx):
         if idx < 0 or idx >= len(self.chat_histories):
             return
+        with profiled("chat_switch"):
+            self.load_chat(idx)
+
+    def load_chat(self, idx):
+        if self.pending_edit:
+            self.pending_edit = None
+            self.show_attachment_status()
         self.current_history_idx = idx
-        self.chat_history = list(self.chat_histories[idx]["history"])
+        self.chat_history = self.chat_histories[idx]["history"]
+        self.show_chat_history()
+
+    def current_chat(self):
+        if self.current_history_idx is None or self.current_history_idx >= len(self.chat_histories):
+            return None
+        return self.chat_histories[self.current_history_idx]
+
+    def show_chat_history(self):
+        """Rebuilds the bubbles for the active branch of the current chat."""
         self.clear_chat_area()
-        for msg in self.chat_history:
+        chat = self.current_chat()
+        branches = branch_info(chat) if chat else []
+        shown = self.chat_history
+        if self.pending_edit and self.pending_edit[0] is chat:
+            shown = shown[:self.pending_edit[1]]  # Display only; the tree is forked when the edit is sent
+        continues = bool(chat) and len(shown) == len(self.chat_history) and leaf_has_children(chat)
+        for position, msg in enumerate(shown):
             think_content = msg.get("think_content") if msg.get("role") == "assistant" else None
-            # last_json = msg.get("last_json") if msg.get("role") == "assistant" else None
-            self.add_chat_bubble(msg["content"], msg["role"], think_content=think_content, last_json=None)  # <-- Remove last_json
+            think_blob = msg.get("think_content_blob") if msg.get("role") == "assistant" else None
+            # Request/response records are read from request_journal by message id
+            self.add_chat_bubble(
+                bubble_text(msg), msg["role"], think_content=think_content, think_blob=think_blob,
+                message_id=msg.get("id"), images=message_images(msg),
+                position=position, branch=branches[position] if position < len(branches) else None,
+                continues=continues and position == len(shown) - 1,
+            )
+
+    def on_bubble_branch(self, position, action):
+        """Forks the current chat at a bubble, or switches that bubble to another branch."""
+        chat = self.current_chat()
+        if chat is None or position >= len(self.chat_history):
+            return
+        msg = self.chat_history[position]
+        self.pending_edit = None
+        if action in ("prev", "next"):
+            switch_branch(chat, position, -1 if action == "prev" else 1)
+            self.show_chat_history()
+        elif action == "down":
+            descend(chat)
+            self.show_chat_history()
+        elif action == "edit":
+            # The edited prompt becomes a sibling of this one once sent; until then nothing changes
+            self.pending_edit = (chat, position)
+            self.show_chat_history()
+            self.command_prompt.setPlainText(msg["content"])
+            self.pending_attachments = list(msg.get("attachments") or [])
+            self.show_attachment_status()
+            self.command_prompt.setFocus()
+            return
+        elif action == "retry":
+            fork(chat, position)
+            self.show_chat_history()
+            last_json = {"request": None, "response": None}
+            self.add_thinking_bubble()
+            QtCore.QTimer.singleShot(100, lambda: self.ollama_query(None, last_json))
+        save_chat_histories(self.chat_histories)
 
     def clear_chat_area(self):
         # Remove thinking label if present
@@ -634,17 +1714,19 @@ class MainWindow(QtWidgets.QMainWindow):
             widget = item.widget()
             if widget:
                 widget.deleteLater()
+        self.chat_area_layout.begin_chat_load()
 
-    def add_chat_bubble(self, text, role="assistant", think_content=None, last_json=None):
+    def add_chat_bubble(self, text, role="assistant", think_content=None, last_json=None, think_blob=None, message_id=None, images=None, position=None, branch=None):
         # Remove thinking label if present before adding a new bubble
         self.remove_thinking_bubble()
         bubble = ChatBubble(
             text, role=role, think_content=think_content, last_json=None,  # <-- Remove last_json from history
-            on_height_ready=lambda: QtCore.QTimer.singleShot(0, self.scroll_to_bottom_signal.emit)
+            think_blob=think_blob, message_id=message_id, images=images, branch=branch,
+            on_branch=(lambda action, p=position: self.on_bubble_branch(p, action)) if position is not None else None,
+            request_height=self.chat_area_layout.request_height
         )
         self.chat_area_layout.addWidget(bubble)
-
-        QtCore.QTimer.singleShot(100, lambda: self.scroll_to_bottom_signal.emit())
+        self.chat_area_layout.scroll_to_bottom()
 
     def eventFilter(self, obj, event):
         # Handle delete key for chat history deletion
@@ -662,7 +1744,7 @@ class MainWindow(QtWidgets.QMainWindow):
     def delete_chat_by_index(self, idx):
         if idx < 0 or idx >= len(self.chat_histories):
             return
-        del self.chat_histories[idx]
+        self.chat_history_model.remove_chat(idx)
         if not self.chat_histories:
             self.add_new_chat()
         else:
@@ -670,20 +1752,16 @@ class MainWindow(QtWidgets.QMainWindow):
             if idx >= len(self.chat_histories):
                 idx = len(self.chat_histories) - 1
             self.current_history_idx = idx
-            self.chat_history = list(self.chat_histories[idx]["history"])
-            self.refresh_chat_history_list()
+            self.chat_history = self.chat_histories[idx]["history"]
             self.chat_history_list.setCurrentRow(idx)
-            self.clear_chat_area()
-            for msg in self.chat_history:
-                self.add_chat_bubble(msg["content"], msg["role"])
-        self.refresh_chat_history_list()
+            self.show_chat_history()
         save_chat_histories(self.chat_histories)  # <-- Save after delete
 
     def delete_selected_chat(self):
         idx = self.chat_history_list.currentRow()
         if idx < 0 or idx >= len(self.chat_histories):
             return
-        del self.chat_histories[idx]
+        self.chat_history_model.remove_chat(idx)
         if not self.chat_histories:
             self.add_new_chat()
         else:
@@ -691,28 +1769,39 @@ class MainWindow(QtWidgets.QMainWindow):
             if idx >= len(self.chat_histories):
                 idx = len(self.chat_histories) - 1
             self.current_history_idx = idx
-            self.chat_history = list(self.chat_histories[idx]["history"])
-            self.refresh_chat_history_list()
+            self.chat_history = self.chat_histories[idx]["history"]
             self.chat_history_list.setCurrentRow(idx)
-            self.clear_chat_area()
-            for msg in self.chat_history:
-                self.add_chat_bubble(msg["content"], msg["role"])
-        self.refresh_chat_history_list()
+            self.show_chat_history()
         save_chat_histories(self.chat_histories)  # <-- Save after delete
 
     def on_command_prompt_enter(self):
         text = self.command_prompt.toPlainText().strip()
-        if text:
-            self.add_chat_bubble(text, role="user")
+        if text or self.pending_attachments:
+            user_msg = Message("user", text)
+            if self.pending_attachments:
+                # Attachments are referenced by blob id, not copied into the history
+                user_msg["attachments"] = self.pending_attachments
+                self.pending_attachments = []
+                self.show_attachment_status()
             self.command_prompt.clear()
-            self.chat_history.append({"role": "user", "content": text})
+            position = branch = None
+            if self.current_history_idx is not None:
+                chat = self.current_chat()
+                if self.pending_edit and self.pending_edit[0] is chat:
+                    # The prefix is shared with the original branch, not copied
+                    fork(chat, self.pending_edit[1])
+                self.pending_edit = None
+                self.show_attachment_status()
+                append_message(chat, user_msg)  # Also extends self.chat_history
+                position, branch = len(self.chat_history) - 1, branch_info(self.current_chat())[-1]
+            self.add_chat_bubble(bubble_text(user_msg), role="user", images=message_images(user_msg), position=position, branch=branch)
             if self.current_history_idx is not None:
-                self.chat_histories[self.current_history_idx]["history"] = list(self.chat_history)
                 first_user = next((m for m in self.chat_history if m["role"] == "user"), None)
                 if first_user:
-                    words = first_user["content"].split()
+                    title_text = first_user["content"] or first_user.get("attachments", [{}])[0].get("name", "")
+                    words = title_text.split()
                     self.chat_histories[self.current_history_idx]["title"] = " ".join(words[:6]) + ("..." if len(words) > 6 else "")
-                self.refresh_chat_history_list()
+                self.chat_history_model.chat_changed(self.current_history_idx)
                 save_chat_histories(self.chat_histories)  # <-- Save after user message
             last_json = {"request": None, "response": None}
             self.add_thinking_bubble()
@@ -800,26 +1889,22 @@ class MainWindow(QtWidgets.QMainWindow):
             # Give focus to the command prompt when it becomes visible
             QtCore.QTimer.singleShot(0, self.command_prompt.setFocus)
 
-    def update_chat(self, reply, think_content, last_json):
+    def update_chat(self, msg, chat, parent):
+        # Added on the GUI thread so saves never see a list being mutated
+        on_active_branch = append_message(chat, msg, parent)
         self.remove_thinking_bubble()
-        self.add_chat_bubble(reply, role="assistant", think_content=think_content, last_json=None)  # <-- Remove last_json
+        if on_active_branch and chat is self.current_chat():
+            self.add_chat_bubble(
+                msg["content"], role="assistant", think_content=msg.get("think_content"),
+                think_blob=msg.get("think_content_blob"), message_id=msg.get("id"),
+                position=len(self.chat_history) - 1, branch=branch_info(chat)[-1],
+            )
         # Save after assistant reply
-        if self.current_history_idx is not None:
-            save_chat_histories(self.chat_histories)
+        save_chat_histories(self.chat_histories)
 
     def refresh_chat_history_list(self):
-        self.chat_history_list.clear()
-        for hist in self.chat_histories:
-            item = QtWidgets.QListWidgetItem()
-            # Store the history dict for custom painting
-            item.setData(QtCore.Qt.ItemDataRole.UserRole, hist)
-            # Set a custom size hint for 50% taller rows
-            base_height = self.chat_history_list.fontMetrics().height()
-            # Estimate a good width (adjust as needed)
-            width = 220
-            # 2.5x the font height is a good starting point for a "tall" row
-            item.setSizeHint(QtCore.QSize(width, int(base_height * 2.5)))
-            self.chat_history_list.addItem(item)
+        # Full reset; incremental changes go through chat_history_model directly
+        self.chat_history_model.set_histories(self.chat_histories)
 
     def refresh_profile_list(self):
         self.profile_list.clear()
@@ -835,6 +1920,45 @@ class MainWindow(QtWidgets.QMainWindow):
         set_selected_profile_idx(idx)
         global system_prefix
         system_prefix = self.profiles[idx]["prefix"]
+        self.update_knowledge_base()
+
+    def knowledge_base(self, prof):
+        """The KnowledgeBase of a profile, or None if it has no knowledge folder."""
+        folder = prof.get("knowledge_folder")
+        if not folder or not os.path.isdir(folder):
+            return None
+        model = prof.get("embedding_model", "").strip()
+        key = (os.path.abspath(folder), model)
+        kb = self._knowledge_bases.get(key)
+        if kb is None:
+            # Without an embedding model the local hashing embedder is used
+            embedder = OllamaEmbedder(get_ollama_client, model) if model else HashingEmbedder()
+            kb = self._knowledge_bases[key] = KnowledgeBase(folder, embedder)
+        return kb
+
+    def update_knowledge_base(self):
+        """
+        Re-embeds changed files of the selected profile's folder on a worker
+        thread. Does nothing while the previous update of that index still runs.
+        """
+        if not 0 <= self.selected_profile_idx < len(self.profiles):
+            return
+        kb = self.knowledge_base(self.profiles[self.selected_profile_idx])
+        if kb is None:
+            return
+
+        def on_done(result):
+            if result and result[0]:
+                self.knowledge_status_signal.emit(
+                    f"Knowledge base: re-embedded {result[0]} files in {kb.last_update[2]:.1f} s; {kb.describe()}"
+                )
+        kb.update_async(on_done)
+
+    def on_knowledge_status(self, text):
+        print(text)
+        item = self.profile_list.item(self.selected_profile_idx)
+        if item:
+            item.setToolTip(text)
 
     def add_new_profile(self):
         new_profile = {"name": "New Profile", "prefix": "You are a helpful assistant."}
@@ -851,7 +1975,7 @@ class MainWindow(QtWidgets.QMainWindow):
         prof = self.profiles[idx]
         dlg = QtWidgets.QDialog(self)
         dlg.setWindowTitle("Edit Profile")
-        dlg.resize(400, 320)
+        dlg.resize(400, 400)
         layout = QtWidgets.QVBoxLayout(dlg)
         name_label = QtWidgets.QLabel("Profile Name:")
         name_edit = QtWidgets.QLineEdit(prof["name"])
@@ -861,11 +1985,28 @@ class MainWindow(QtWidgets.QMainWindow):
         prefix_edit = QtWidgets.QTextEdit(prof["prefix"])
         layout.addWidget(prefix_label)
         layout.addWidget(prefix_edit)
+        layout.addWidget(QtWidgets.QLabel("Knowledge Folder:"))
+        folder_row = QtWidgets.QHBoxLayout()
+        folder_edit = QtWidgets.QLineEdit(prof.get("knowledge_folder", ""))
+        folder_edit.setPlaceholderText("Local folder whose documents are retrieved into prompts")
+        browse_btn = QtWidgets.QPushButton("Browse...")
+        browse_btn.clicked.connect(lambda: folder_edit.setText(
+            QtWidgets.QFileDialog.getExistingDirectory(dlg, "Knowledge Folder", folder_edit.text()) or folder_edit.text()
+        ))
+        folder_row.addWidget(folder_edit, 1)
+        folder_row.addWidget(browse_btn)
+        layout.addLayout(folder_row)
+        layout.addWidget(QtWidgets.QLabel("Embedding Model:"))
+        embed_edit = QtWidgets.QLineEdit(prof.get("embedding_model", ""))
+        embed_edit.setPlaceholderText("e.g. nomic-embed-text; blank uses a local hashing embedder")
+        layout.addWidget(embed_edit)
         btns = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.StandardButton.Ok | QtWidgets.QDialogButtonBox.StandardButton.Cancel)
         layout.addWidget(btns)
         def save_profile():
             prof["name"] = name_edit.text().strip() or "Profile"
             prof["prefix"] = prefix_edit.toPlainText()
+            prof["knowledge_folder"] = folder_edit.text().strip()
+            prof["embedding_model"] = embed_edit.text().strip()
             self.profiles[idx] = prof
             save_profiles(self.profiles)
             self.refresh_profile_list()
@@ -874,6 +2015,7 @@ class MainWindow(QtWidgets.QMainWindow):
             if idx == self.selected_profile_idx:
                 global system_prefix
                 system_prefix = prof["prefix"]
+                self.update_knowledge_base()
             dlg.accept()
         btns.accepted.connect(save_profile)
         btns.rejected.connect(dlg.reject)
@@ -882,6 +2024,13 @@ class MainWindow(QtWidgets.QMainWindow):
     def ollama_query(self, text, last_json):
         import re
         import threading
+        # The reply belongs to this chat and branch point even if the user switches away or forks;
+        # the snapshot is of references only and keeps a fork from changing the request in flight
+        chat = self.current_chat()
+        parent = chat["leaf"]
+        history = tuple(chat["history"])
+        profile = self.profiles[self.selected_profile_idx]
+        kb = self.knowledge_base(profile)
         def run():
             try:
                 model = self.model_combo.currentText() or selected_model
@@ -891,25 +2040,57 @@ class MainWindow(QtWidgets.QMainWindow):
                     {"role": "control", "content": "thinking"},
                     {"role": "system", "content": "Enable deep thinking subroutine."},
                     {"role": "system", "content": prefix},
-                ] + self.chat_history
-                last_json["request"] = {"model": model, "messages": messages}
+                ] + [request_message(m) for m in history]
+                if kb and history and history[-1]["role"] == "user":
+                    try:
+                        results = kb.search(
+                            history[-1]["content"],
+                            profile.get("knowledge_top_k", DEFAULT_TOP_K),
+                            profile.get("knowledge_tokens", DEFAULT_TOKEN_BUDGET),
+                        )
+                    except Exception as e:
+                        print(f"Knowledge base search failed: {e}")
+                        results = []
+                    if results:
+                        # Right before the prompt, so the earlier history stays a cacheable prefix
+                        messages.insert(len(messages) - 1, {"role": "system", "content": knowledge_context(results)})
+                    last_json["retrieval"] = {
+                        "latency_ms": round(kb.last_latency_ms or 0, 2),
+                        "chunks": [{"file": rel, "score": round(score, 4)} for score, rel, _ in results],
+                        "index": kb.stats(),
+                    }
+                # The journal records image sizes, not the base64 payloads
+                logged = [
+                    dict(m, images=[f"<image, {len(i)} base64 chars>" for i in m["images"]]) if "images" in m else m
+                    for m in messages
+                ]
+                last_json["request"] = {"model": model, "messages": logged}
                 tools_text = self.config.get("tools", "").strip()
                 response = None
                 tool_error = False
-                if tools_text:
+                # Known metadata lets us skip tools for models that can't use them
+                chat_options = {}
+                num_ctx = self.request_num_ctx(model)
+                if num_ctx:
+                    chat_options["options"] = {"num_ctx": num_ctx}
+                    last_json["request"]["options"] = chat_options["options"]
+                if tools_text and self.model_registry.supports_tools(model) is not False:
                     last_json["request"]["tools"] = tools_text
                     try:
-                        response = ollama_client.chat(model=model, messages=messages, tools=[get_current_date, fetch_url_content])
+                        response = get_ollama_client().chat(model=model, messages=messages, tools=[get_current_date, fetch_url_content], **chat_options)
                     except Exception as e:
                         if hasattr(e, "args") and e.args and "does not support tools" in str(e.args[0]):
                             tool_error = True
-                            response = ollama_client.chat(model=model, messages=messages)
+                            self.model_registry.mark_no_tools(model)
+                            self.model_metadata_signal.emit()
+                            response = get_ollama_client().chat(model=model, messages=messages, **chat_options)
                         else:
                             raise
                 else:
-                    response = ollama_client.chat(model=model, messages=messages)
+                    response = get_ollama_client().chat(model=model, messages=messages, **chat_options)
                 last_json["response"] = response
                 tool_calls = response.get("message", {}).get("tool_calls")
+                stored_tool_results = []
                 if tool_calls and not tool_error:
                     tool_results = []
                     for call in tool_calls:
@@ -926,6 +2107,8 @@ class MainWindow(QtWidgets.QMainWindow):
                         else:
                             result = f"Unknown tool: {tool_name}"
                         tool_results.append({"role": "tool", "content": result, 'name': tool_name})
+                        # Tool output (e.g. whole HTML pages) is kept by hash, deduplicated
+                        stored_tool_results.append({"name": tool_name, "content_blob": put_blob(str(result))})
                     messages = messages + [{
                         "role": "system",
                         "tool_calls": [{
@@ -936,12 +2119,13 @@ class MainWindow(QtWidgets.QMainWindow):
                         } for call in tool_calls],
                     }] + tool_results
                     try:
-                        tool_response = ollama_client.chat(model=model, messages=messages, tools=[get_current_date, fetch_url_content])
+                        tool_response = get_ollama_client().chat(model=model, messages=messages, tools=[get_current_date, fetch_url_content], **chat_options)
                     except Exception as e:
                         if hasattr(e, "args") and e.args and "does not support tools" in str(e.args[0]):
-                            tool_response = ollama_client.chat(model=model, messages=messages)
+                            tool_response = get_ollama_client().chat(model=model, messages=messages, **chat_options)
                         else:
                             raise
+                    last_json["tool_response"] = tool_response
                     reply = tool_response.get("message", {}).get("content", "No response.")
                     think_match = re.search(r"<think>(.*?)</think>", reply, re.DOTALL | re.IGNORECASE)
                     think_content = think_match.group(1).strip() if think_match else None
@@ -959,44 +2143,80 @@ class MainWindow(QtWidgets.QMainWindow):
                 import traceback
                 reply = f"Error: {e}\n{traceback.format_exc()}"
                 think_content = None
-            # --- Save think_content and last_json with assistant message ---
-            self.chat_history.append({
-                "role": "assistant",
-                "content": reply,
-                "think_content": think_content
-                # "last_json": last_json  # <-- Remove this line
-            })
-            if self.current_history_idx is not None:
-                self.chat_histories[self.current_history_idx]["history"] = list(self.chat_history)
-                self.refresh_chat_history_list()
-            self.update_chat_signal.emit(reply, think_content, last_json)
+                stored_tool_results = []
+            # --- Save think_content with assistant message; last_json goes to the journal ---
+            message_id = uuid.uuid4().hex
+            request_journal.append(message_id, last_json)
+            assistant_msg = Message("assistant", reply, id=message_id, think_content=think_content)
+            if stored_tool_results:
+                assistant_msg["tool_results"] = stored_tool_results
+            self.update_chat_signal.emit(externalize_message(assistant_msg), chat, parent)
         # When starting, show "Thinking..." by default
         QtCore.QTimer.singleShot(0, lambda: self.add_thinking_bubble())
-        threading.Thread(target=run, daemon=True).start()
+        threading.Thread(target=lambda: diagnostics.run_profiled("ollama_query", run), daemon=True).start()
 
     def closeEvent(self, event):
         self.config["geometry"] = self.saveGeometry().toHex().data().decode()
-        self.config["selected_model"] = self.model_combo.currentText()
+        if self.model_combo.count():
+            self.config["selected_model"] = self.model_combo.currentText()
         self.config["profiles"] = self.profiles
         self.config["selected_profile_idx"] = self.selected_profile_idx
+        self.config["model_metadata"] = self.model_registry.to_config()
         save_config(self.config)
         save_chat_histories(self.chat_histories)
+        request_journal.close()
+        markdown_renderer.shutdown()
+        for kb in self._knowledge_bases.values():
+            kb.close()
+        if self._stall_watchdog:
+            self._stall_watchdog.stop()
         event.accept()
 
 if __name__ == "__main__":
     import sys
-    from PyQt6.QtWebEngineWidgets import QWebEngineView
+    import argparse
     from PyQt6 import QtWidgets, QtCore
 
-    app = QtWidgets.QApplication(sys.argv)
-
-    # Create dummy after QApplication to pre-initialize WebEngine
-    dummy = QWebEngineView()
-    dummy.deleteLater()
-
-    # Now show your main window
-    win = MainWindow()
+    parser = argparse.ArgumentParser(description="Ollama chat client")
+    parser.add_argument("--profile", action="store_true", help="profile queries, chat switches and saves; dump on exit")
+    parser.add_argument("--tracemalloc", action="store_true", help="trace allocations; dump a snapshot on exit")
+    parser.add_argument("--debug-panel", action="store_true", help="open the diagnostics panel at startup")
+    parser.add_argument("--diagnostics-dir", default=diagnostics.DIAGNOSTICS_DIR, help="where diagnostics files are written")
+    parser.add_argument("--stall-threshold", type=int, default=None, metavar="MS", help="report GUI stalls longer than MS milliseconds (0 disables)")
+    parser.add_argument("--renderer", choices=RENDERERS, default=None, help="chat bubble renderer (default from config, else webengine)")
+    parser.add_argument("--fast-start", action="store_true", help="use the textbrowser renderer so Chromium is never loaded")
+    args, qt_args = parser.parse_known_args()
+    startup_config = load_config()
+    renderer_backend = args.renderer or ("textbrowser" if args.fast_start else startup_config.get("renderer", "webengine"))
+    diagnostics.DIAGNOSTICS_DIR = args.diagnostics_dir
+    if args.profile:
+        diagnostics.set_profiling(True)
+    if args.tracemalloc:
+        diagnostics.start_tracemalloc()
+
+    if renderer_backend == "webengine":
+        # Lets QtWebEngineWidgets be imported lazily, after the QApplication exists
+        QtCore.QCoreApplication.setAttribute(QtCore.Qt.ApplicationAttribute.AA_ShareOpenGLContexts)
+    app = QtWidgets.QApplication([sys.argv[0]] + qt_args)
+
+    def report_cold_start(shown_at):
+        elapsed_ms = (shown_at - _process_start) * 1000
+        target_ms = startup_config.get("cold_start_target_ms", DEFAULT_COLD_START_TARGET_MS)
+        verdict = "OVER target" if elapsed_ms > target_ms else "within target"
+        print(f"Cold start: window shown after {elapsed_ms:.0f} ms ({verdict} of {target_ms} ms, renderer {renderer_backend})")
+
+    # Show the window first; WebEngine starts when the first chat bubble is created
+    win = MainWindow(stall_threshold_ms=args.stall_threshold)
+    win.window_shown_signal.connect(report_cold_start)
     win.show()
-
-    sys.exit(app.exec())
+    if args.debug_panel:
+        win.open_debug_panel()
+
+    exit_code = app.exec()
+    if args.profile:
+        print("Profiles written to:", ", ".join(diagnostics.dump_profiles()))
+    if args.tracemalloc:
+        diagnostics.take_snapshot()
+        print("Snapshot written to:", diagnostics.dump_snapshot())
+    sys.exit(exit_code)
 
@@ -0,0 +1,201 @@
+class Message:
+    """
+    A chat message with fixed fields in __slots__.
+
+    It supports the small dict protocol the rest of the client uses
+    (msg["content"], msg.get(...), "field" in msg, item assignment/deletion
+    and items()), so code can treat it like the plain dicts it replaces. Unset
+    fields are None and behave as missing keys. Keys outside the fixed fields
+    (e.g. from older history files) are kept in ``extra``.
+    """
+    FIELDS = ("id", "parent", "role", "content", "think_content", "think_content_blob", "tool_results", "attachments")
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, role, content, **fields):
+        self.role = role
+        self.content = content
+        self.id = None
+        self.parent = None  # Index of the parent message in the chat's tree; None for the first message
+        self.think_content = None
+        self.think_content_blob = None
+        self.tool_results = None
+        self.attachments = None
+        self.extra = None
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, d):
+        if isinstance(d, Message):
+            return d
+        msg = cls(d.get("role", "assistant"), d.get("content", ""))
+        for key, value in d.items():
+            if key not in ("role", "content"):
+                msg[key] = value
+        return msg
+
+    def to_dict(self):
+        """Plain JSON-ready dict of the fields that are set."""
+        return dict(self.items())
+
+    def items(self):
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                yield key, value
+        if self.extra:
+            yield from self.extra.items()
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+        else:
+            value = self.extra.get(key) if self.extra else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self.FIELDS:
+            setattr(self, key, None)
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __repr__(self):
+        return f"Message({self.to_dict()!r})"
+
+
+# --- Conversation trees ---
+#
+# A chat keeps every message it ever had in chat["tree"], each pointing at its
+# parent by index, and chat["leaf"] is the last message of the active branch.
+# chat["history"] is the active branch: the same Message objects, in order.
+# Branches share their common prefix; forking never copies a message.
+
+_LEAF = object()
+
+
+def _path(chat):
+    tree, i, path = chat["tree"], chat["leaf"], []
+    while i is not None:
+        path.append(i)
+        i = tree[i].parent
+    return path[::-1]
+
+
+def _children(tree):
+    children = {}
+    for i, msg in enumerate(tree):
+        children.setdefault(msg.parent, []).append(i)
+    return children
+
+
+def init_chat_tree(chat):
+    """
+    Builds the tree fields of a loaded or imported chat. Chats from before
+    branching only have a flat "history", which becomes a single branch.
+    Returns the chat.
+    """
+    if "tree" not in chat:
+        tree = [Message.from_dict(m) for m in chat.get("history", [])]
+        for i, msg in enumerate(tree):
+            msg.parent = i - 1 if i else None
+        chat["tree"] = tree
+        chat["leaf"] = len(tree) - 1 if tree else None
+    else:
+        chat["tree"] = [Message.from_dict(m) for m in chat["tree"]]
+        chat.setdefault("leaf", len(chat["tree"]) - 1 if chat["tree"] else None)
+    chat["history"] = [chat["tree"][i] for i in _path(chat)]
+    if chat["leaf"] is None and chat["tree"]:
+        descend(chat)  # An empty active branch would hide every message
+    return chat
+
+
+def append_message(chat, msg, parent=_LEAF):
+    """
+    Adds msg as a child of parent (default: the active leaf). The active branch
+    only grows if parent is its leaf, so a reply that arrives after the user
+    forked lands on its own branch. Returns True if msg is on the active branch.
+    """
+    if parent is _LEAF:
+        parent = chat["leaf"]
+    msg.parent = parent
+    chat["tree"].append(msg)
+    if parent != chat["leaf"]:
+        return False
+    chat["leaf"] = len(chat["tree"]) - 1
+    chat["history"].append(msg)
+    return True
+
+
+def fork(chat, position):
+    """Makes the active branch end just before history[position]; the next message starts a new branch."""
+    path = _path(chat)
+    chat["leaf"] = path[position - 1] if position > 0 else None
+    del chat["history"][position:]
+
+
+def switch_branch(chat, position, step):
+    """
+    Moves history[position] to its step-th next sibling and follows that
+    branch down to its newest leaf. history is updated in place.
+    """
+    tree = chat["tree"]
+    node = _path(chat)[position]
+    children = _children(tree)
+    siblings = children[tree[node].parent]
+    chat["leaf"] = siblings[(siblings.index(node) + step) % len(siblings)]
+    descend(chat, children)
+
+
+def descend(chat, children=None):
+    """Extends the active branch from its leaf along the newest children. history is updated in place."""
+    children = children or _children(chat["tree"])
+    node = chat["leaf"]
+    while node in children:
+        node = children[node][-1]
+    chat["leaf"] = node
+    chat["history"][:] = [chat["tree"][i] for i in _path(chat)]
+
+
+def leaf_has_children(chat):
+    """True if messages continue past the end of the active branch (e.g. after an unfinished retry)."""
+    leaf = chat["leaf"]
+    return leaf is not None and any(m.parent == leaf for m in chat["tree"])
+
+
+def branch_info(chat):
+    """(branch number, branch count) for each message of the active branch."""
+    children = _children(chat["tree"])
+    info = []
+    for i in _path(chat):
+        siblings = children[chat["tree"][i].parent]
+        info.append((siblings.index(i) + 1, len(siblings)))
+    return info
+
+
+def chat_to_dict(chat):
+    """JSON-ready form of a chat; history is derived from the tree and not stored."""
+    out = {k: v for k, v in chat.items() if k not in ("history", "tree")}
+    out["tree"] = [m.to_dict() for m in chat["tree"]]
+    return out
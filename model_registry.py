@@ -0,0 +1,120 @@
+import threading
+
+# Bump when _parse_show extracts new keys, so cached entries are inspected again
+METADATA_VERSION = 2
+
+
+def _parse_show(show):
+    """Extracts the metadata we care about from an ollama show() response."""
+    capabilities = getattr(show, "capabilities", None)
+    template = getattr(show, "template", None) or ""
+    if capabilities is None:
+        # Older servers/clients have no capabilities list; the template tells us about tools
+        capabilities = ["completion"] + (["tools"] if ".Tools" in template else [])
+    modelinfo = getattr(show, "modelinfo", None) or {}
+    context_length = next(
+        (int(v) for k, v in modelinfo.items() if k.endswith(".context_length") and v), None
+    )
+    # Vision models report the input resolution of their image encoder
+    projector = getattr(show, "projector_info", None) or {}
+    image_size = next(
+        (int(v) for k, v in list(projector.items()) + list(modelinfo.items()) if k.endswith("vision.image_size") and v), None
+    )
+    details = getattr(show, "details", None)
+    return {
+        "capabilities": list(capabilities),
+        "context_length": context_length,
+        "image_size": image_size,
+        "parameter_size": getattr(details, "parameter_size", None),
+        "family": getattr(details, "family", None),
+        "quantization_level": getattr(details, "quantization_level", None),
+    }
+
+
+class ModelRegistry:
+    """
+    Cache of per-model metadata (capabilities, context length, parameter size)
+    keyed by model name and invalidated when the model digest or
+    METADATA_VERSION changes.
+
+    The cache is a plain dict so it can be persisted in the client config.
+    """
+
+    def __init__(self, client_factory, cache=None):
+        # A factory so the Ollama client is only created when a refresh needs it
+        self._client_factory = client_factory
+        self._cache = dict(cache or {})
+        self._lock = threading.Lock()
+
+    def to_config(self):
+        with self._lock:
+            return dict(self._cache)
+
+    def get(self, model):
+        with self._lock:
+            return self._cache.get(model)
+
+    def supports_tools(self, model):
+        """True/False if known, None if the model has not been inspected yet."""
+        meta = self.get(model)
+        if not meta:
+            return None
+        return "tools" in meta.get("capabilities", [])
+
+    def context_length(self, model):
+        meta = self.get(model)
+        return meta.get("context_length") if meta else None
+
+    def image_size(self, model):
+        meta = self.get(model)
+        return meta.get("image_size") if meta else None
+
+    def supports_vision(self, model):
+        """True/False if known, None if the model has not been inspected yet."""
+        meta = self.get(model)
+        if not meta:
+            return None
+        return "vision" in meta.get("capabilities", [])
+
+    def mark_no_tools(self, model):
+        """Records a "does not support tools" error so the next request skips tools."""
+        with self._lock:
+            meta = self._cache.setdefault(model, {"capabilities": ["completion"]})
+            meta["capabilities"] = [c for c in meta.get("capabilities", []) if c != "tools"]
+
+    def refresh(self, models):
+        """
+        Calls show() for every model whose digest is new or changed.
+        models is the list returned by client.list(). Returns True if anything changed.
+        """
+        changed = False
+        current = set()
+        for m in models:
+            name, digest = m.model, getattr(m, "digest", None)
+            current.add(name)
+            cached = self.get(name)
+            if cached and cached.get("digest") == digest and cached.get("version") == METADATA_VERSION:
+                continue
+            try:
+                meta = _parse_show(self._client_factory().show(name))
+            except Exception as e:
+                print(f"Error fetching metadata for {name}: {e}")
+                continue
+            meta["digest"] = digest
+            meta["version"] = METADATA_VERSION
+            with self._lock:
+                self._cache[name] = meta
+            changed = True
+        if current:
+            with self._lock:
+                for name in [n for n in self._cache if n not in current]:
+                    del self._cache[name]  # Model was removed from the server
+                    changed = True
+        return changed
+
+    def refresh_async(self, models, on_done=None):
+        def run():
+            changed = self.refresh(models)
+            if on_done:
+                on_done(changed)
+        threading.Thread(target=run, daemon=True).start()
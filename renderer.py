@@ -0,0 +1,79 @@
+import html
+import multiprocessing
+import re
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+EXTENSIONS = ["tables", "fenced_code", "codehilite"]
+SYNC_THRESHOLD = 2000  # Short messages without code render inline; not worth a round trip
+PROCESS_THRESHOLD = 50000  # Very large messages go to a process pool to keep the GIL free
+HUGE_CODE_BLOCK = 20000  # Code blocks bigger than this are highlighted in a second pass
+
+_FENCE = re.compile(
+    r"^(?P<fence>`{3,}|~{3,})[^\n]*\n.*?^(?P=fence)[ \t]*$",
+    re.MULTILINE | re.DOTALL,
+)
+
+
+def plain_html(message):
+    """Escaped plain text, shown until the rendered markdown is ready."""
+    return f'<pre style="white-space: pre-wrap; font-family: inherit; background: none; padding: 0;">{html.escape(message)}</pre>'
+
+
+def needs_async(message):
+    return len(message) >= SYNC_THRESHOLD or "```" in message or "~~~" in message
+
+
+def render_markdown(message, lazy_code=True):
+    """
+    Renders markdown to an HTML body. Returns (html, deferred).
+
+    With lazy_code, fenced blocks over HUGE_CODE_BLOCK are rendered as plain
+    text (deferred is True) so the first pass stays fast; render again with
+    lazy_code=False to highlight them.
+    """
+    import markdown  # Deferred: markdown and Pygments are only loaded once something renders
+    deferred = False
+    if lazy_code:
+        def demote(match):
+            nonlocal deferred
+            block = match.group(0)
+            if len(block) < HUGE_CODE_BLOCK:
+                return block
+            deferred = True
+            return match.group("fence") + "text" + block[block.index("\n"):]
+        message = _FENCE.sub(demote, message)
+    return markdown.markdown(message, extensions=EXTENSIONS), deferred
+
+
+class MarkdownRenderer:
+    """Renders markdown off the GUI thread; submit() returns a Future of (html, deferred)."""
+
+    def __init__(self, threads=2, processes=1):
+        self._threads = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="markdown")
+        self._process_count = processes
+        self._processes = None
+
+    def _process_pool(self):
+        if self._processes is None:
+            try:
+                # Forking a process with Qt and its threads running is unsafe; start clean workers
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self._process_count, mp_context=multiprocessing.get_context("spawn")
+                )
+            except (OSError, NotImplementedError, ValueError) as e:
+                print(f"Markdown process pool unavailable, using threads: {e}")
+                self._processes = self._threads
+        return self._processes
+
+    def submit(self, message, lazy_code=True):
+        if len(message) >= PROCESS_THRESHOLD:
+            try:
+                return self._process_pool().submit(render_markdown, message, lazy_code)
+            except RuntimeError:
+                pass  # Broken process pool; threads still work
+        return self._threads.submit(render_markdown, message, lazy_code)
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False)
+        if self._processes is not None and self._processes is not self._threads:
+            self._processes.shutdown(wait=True)  # wait=False breaks interpreter exit on 3.8
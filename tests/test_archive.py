@@ -0,0 +1,73 @@
+import json
+import shutil
+
+import pytest
+
+from archive import export_jsonl, iter_archive
+from blob_store import BLOB_DIR, put_blob, get_blob, externalize_message, message_field
+from messages import Message, init_chat_tree, chat_to_dict, append_message, fork, branch_info
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # The blob store lives relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    get_blob.cache_clear()
+
+
+def test_attachments_survive_export_and_import(tmp_path):
+    excerpt = "log line\n" * 100
+    att = {"id": put_blob(excerpt), "name": "app.log", "size": 900, "lines": 100, "tokens": 225, "sent_tokens": 225, "trimmed": False}
+    image = {"type": "image", "id": put_blob("aW1hZ2U="), "thumbnail": put_blob("dGh1bWI="), "name": "shot.png",
+             "size": 10, "width": 4, "height": 3, "original": [4, 3]}
+    chat = {"title": "with files", "history": [
+        Message("user", "look at these", attachments=[att, image]),
+        Message("assistant", "ok"),
+    ]}
+    path = str(tmp_path / "chats.jsonl")
+    export_jsonl([chat], path)
+
+    # The archive must not depend on this machine's blob store
+    shutil.rmtree(BLOB_DIR)
+    get_blob.cache_clear()
+
+    [imported] = list(iter_archive(path))
+    msg = imported["history"][0]
+    text_att, image_att = msg["attachments"]
+    assert text_att["name"] == "app.log" and get_blob(text_att["id"]) == excerpt
+    assert "content" not in text_att
+    assert image_att["type"] == "image"
+    assert get_blob(image_att["id"]) == "aW1hZ2U="
+    assert get_blob(image_att["thumbnail"]) == "dGh1bWI="
+    assert imported["history"][1]["content"] == "ok"
+
+
+def test_import_chat_histories_with_blob_references(tmp_path):
+    think = "reasoning " * 500  # Long enough to be externalized
+    page = "<html>" + "x" * 5000 + "</html>"
+    msg = externalize_message(Message("assistant", "done", think_content=think,
+                                      tool_results=[{"name": "fetch_url_content", "content_blob": put_blob(page)}]))
+    assert "think_content_blob" in msg
+    chat = init_chat_tree({"title": "saved", "history": [Message("user", "fetch it"), msg]})
+    path = tmp_path / "chat_histories.json"
+    path.write_text(json.dumps([chat_to_dict(chat)]), encoding="utf-8")
+
+    [imported] = list(iter_archive(str(path)))
+    reply = imported["history"][1]
+    assert message_field(reply, "think_content") == think
+    assert get_blob(reply["tool_results"][0]["content_blob"]) == page
+
+
+def test_branches_survive_export_and_import(tmp_path):
+    chat = init_chat_tree({"title": "branched", "history": [Message("user", "first"), Message("assistant", "reply one")]})
+    fork(chat, 1)  # Retry: a second reply to the same prompt
+    append_message(chat, Message("assistant", "reply two"))
+    append_message(chat, Message("user", "follow-up"))
+    path = str(tmp_path / "chats.jsonl")
+    export_jsonl([chat], path)
+
+    [imported] = list(iter_archive(path))
+    assert len(imported["tree"]) == 4
+    assert [m["content"] for m in imported["history"]] == ["first", "reply two", "follow-up"]
+    assert branch_info(imported) == [(1, 1), (2, 2), (1, 1)]
+    assert imported["tree"][1]["content"] == "reply one" and imported["tree"][1].parent == 0
@@ -0,0 +1,26 @@
+import hashlib
+
+import pytest
+
+from blob_store import put_blob, get_blob
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # The blob store lives relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    get_blob.cache_clear()
+
+
+def test_missing_blob_is_not_cached():
+    text = "written after the first lookup"
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    assert get_blob(digest) is None
+    assert put_blob(text) == digest
+    assert get_blob(digest) == text
+
+
+def test_round_trip_both_codecs():
+    small, big = "short blob", "x" * (128 * 1024)
+    assert get_blob(put_blob(small)) == small
+    assert get_blob(put_blob(big)) == big
@@ -0,0 +1,138 @@
+import os
+import threading
+
+import pytest
+
+import knowledge
+from knowledge import KnowledgeBase, HashingEmbedder, chunk_text
+
+
+@pytest.fixture
+def docs(tmp_path, monkeypatch):
+    # KNOWLEDGE_DIR is relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / "docs"
+    folder.mkdir()
+    return folder
+
+
+def write(path, text, mtime=None):
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_chunk_text_overlaps_and_cuts_at_lines():
+    text = "".join(f"line {i:03d} of the document\n" for i in range(200))
+    chunks = chunk_text(text, size=300, overlap=50)
+    assert len(chunks) > 1
+    assert all(len(c) <= 300 for c in chunks)
+    # Every chunk after the first starts inside the previous one
+    for prev, cur in zip(chunks, chunks[1:]):
+        assert cur[:20] in prev
+    # Cuts fall on line breaks, so chunks end with a whole line
+    assert all(c.endswith("of the document") for c in chunks[:-1])
+    assert "line 199" in chunks[-1]
+
+
+def test_chunk_text_short_and_empty():
+    assert chunk_text("") == []
+    assert chunk_text("   \n  ") == []
+    assert chunk_text("short text") == ["short text"]
+
+
+def test_update_is_incremental(docs, monkeypatch):
+    write(docs / "billing.txt", "The billing service retries failed payments three times.\n", mtime=1000)
+    write(docs / "deploy.md", "Deploy the frontend with nginx and docker compose.\n", mtime=1000)
+    write(docs / "old.txt", "Legacy notes about the fax gateway.\n", mtime=1000)
+    kb = KnowledgeBase(str(docs), HashingEmbedder())
+    assert kb.update() == (3, 3)
+    assert kb.update() == (0, 3)
+
+    embedded = []
+    embedder = kb.embedder
+    original = embedder.embed
+    monkeypatch.setattr(embedder, "embed", lambda texts: embedded.extend(texts) or original(texts))
+    write(docs / "deploy.md", "Deploy the frontend with kubernetes helm charts.\n", mtime=2000)
+    os.remove(docs / "old.txt")
+    assert kb.update() == (1, 2)
+    # Only the changed file was embedded again
+    assert embedded == ["Deploy the frontend with kubernetes helm charts."]
+
+    files = {rel for _, rel, _ in kb.search("frontend billing fax", top_k=10, token_budget=10000)}
+    assert files == {"billing.txt", "deploy.md"}
+    assert kb.search("kubernetes helm")[0][1] == "deploy.md"
+    assert kb.stats()["files"] == 2
+    kb.close()
+
+
+def test_update_after_empty_files(docs):
+    write(docs / "empty.txt", "")
+    kb = KnowledgeBase(str(docs), HashingEmbedder())
+    assert kb.update() == (1, 0)
+    write(docs / "a.md", "hello knowledge base\n")
+    assert kb.update() == (1, 1)
+    assert kb.search("hello")[0][1] == "a.md"
+    kb.close()
+
+
+def test_search_ranks_by_similarity(docs):
+    write(docs / "billing.txt", "Payments are retried three times by the billing worker.\n")
+    write(docs / "deploy.md", "The frontend is deployed with nginx.\n")
+    write(docs / "oncall.md", "The on-call rotation changes every Monday.\n")
+    kb = KnowledgeBase(str(docs), HashingEmbedder())
+    kb.update()
+    results = kb.search("how often are payments retried by billing", top_k=3)
+    assert results[0][1] == "billing.txt"
+    scores = [score for score, _, _ in results]
+    assert scores == sorted(scores, reverse=True)
+    assert kb.last_latency_ms is not None
+    kb.close()
+
+
+def test_search_respects_token_budget(docs):
+    long_text = "payments " * 400  # ~900 tokens
+    write(docs / "long.txt", long_text)
+    write(docs / "short.txt", "payments retried\n")
+    kb = KnowledgeBase(str(docs), HashingEmbedder())
+    kb.update()
+    everything = kb.search("payments", top_k=10, token_budget=100000)
+    assert {rel for _, rel, _ in everything} == {"long.txt", "short.txt"}
+    trimmed = kb.search("payments", top_k=10, token_budget=50)
+    assert trimmed and all(rel == "short.txt" for _, rel, _ in trimmed)
+    assert sum(knowledge.estimate_tokens(text) for _, _, text in trimmed) <= 50
+    kb.close()
+
+
+def test_embedder_change_rebuilds(docs):
+    write(docs / "a.md", "alpha beta gamma\n")
+    kb = KnowledgeBase(str(docs), HashingEmbedder(dim=64))
+    kb.update()
+    kb.close()
+    kb = KnowledgeBase(str(docs), HashingEmbedder(dim=128))
+    assert kb.update() == (1, 1)
+    assert kb.search("alpha")[0][1] == "a.md"
+    kb.close()
+    # Each embedder keeps its own index, so switching back does not rebuild
+    kb = KnowledgeBase(str(docs), HashingEmbedder(dim=64))
+    assert kb.update() == (0, 1)
+    kb.close()
+
+
+def test_update_async_skips_while_running(docs, monkeypatch):
+    write(docs / "a.md", "alpha beta gamma\n")
+    kb = KnowledgeBase(str(docs), HashingEmbedder())
+    release, finished = threading.Event(), threading.Event()
+    original = kb.update
+    monkeypatch.setattr(kb, "update", lambda: release.wait(5) and original())
+    results = []
+    assert kb.update_async(lambda result: results.append(result) or finished.set())
+    assert not kb.update_async(results.append)
+    release.set()
+    assert finished.wait(5)
+    assert results == [(1, 1)]
+    # Once the first update is done a new one may start
+    finished.clear()
+    assert kb.update_async(lambda result: finished.set())
+    assert finished.wait(5)
+    kb.close()
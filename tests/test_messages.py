@@ -0,0 +1,52 @@
+import json
+
+from messages import Message, init_chat_tree, append_message, fork, switch_branch, descend, leaf_has_children, branch_info, chat_to_dict
+
+
+def make_chat(*contents):
+    roles = ["user", "assistant"]
+    return init_chat_tree({"title": "t", "history": [
+        {"role": roles[i % 2], "content": c} for i, c in enumerate(contents)
+    ]})
+
+
+def contents(chat):
+    return [m.content for m in chat["history"]]
+
+
+def reload(chat):
+    return init_chat_tree(json.loads(json.dumps(chat_to_dict(chat))))
+
+
+def test_fork_shares_prefix_and_switches():
+    chat = make_chat("q1", "a1", "q2", "a2")
+    prefix = chat["history"][:2]
+    fork(chat, 2)
+    append_message(chat, Message("user", "q2b"))
+    assert contents(chat) == ["q1", "a1", "q2b"]
+    assert all(a is b for a, b in zip(chat["history"], prefix))
+    assert branch_info(chat)[2] == (2, 2)
+    switch_branch(chat, 2, -1)
+    assert contents(chat) == ["q1", "a1", "q2", "a2"]
+    assert contents(reload(chat)) == ["q1", "a1", "q2", "a2"]
+
+
+def test_late_reply_lands_on_its_own_branch():
+    chat = make_chat("q1")
+    parent = chat["leaf"]
+    fork(chat, 0)
+    append_message(chat, Message("user", "other"))
+    assert not append_message(chat, Message("assistant", "late"), parent)
+    assert contents(chat) == ["other"]
+    switch_branch(chat, 0, -1)
+    assert contents(chat) == ["q1", "late"]
+
+
+def test_unfinished_fork_stays_reachable():
+    chat = make_chat("q1", "a1")
+    fork(chat, 1)  # e.g. a retry whose reply never arrived
+    assert leaf_has_children(chat)
+    descend(chat)
+    assert contents(chat) == ["q1", "a1"]
+    fork(chat, 0)
+    assert contents(reload(chat)) == ["q1", "a1"]
@@ -1,5 +1,4 @@
 from datetime import date
-import requests
 
 def get_current_date():
     """
@@ -10,6 +9,7 @@ def fetch_url_content(url):
     """
     Fetches the content of the given URL and returns it as text.
     """
+    import requests  # Imported on first use to keep startup fast
     response = requests.get(url)
     response.raise_for_status()
     return response.text